@@ -2,7 +2,64 @@ import inspect
 from os import getenv
 from pathlib import Path
 
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "y", "on"}
+
+
+def _env_int(name: str, default: int) -> int:
+    value = getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = getenv(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
 PLUGINS_DIR: Path = Path(inspect.getfile(lambda _: _)).parent.joinpath("plugins")
 
 _persist_dir = getenv("PERSIST_DIR") or "/persist/storage"
 PERSIST_DIR: Path = Path(_persist_dir)
+
+# Where plugin data is persisted, either "json" (one file per namespace) or "sqlite"
+STORAGE_BACKEND: str = (getenv("HBOT_STORAGE_BACKEND") or "json").strip().lower()
+
+# Index plugins at startup and only import them when one of their commands is first used
+LAZY_PLUGINS: bool = _env_bool("HBOT_LAZY_PLUGINS")
+
+# Shared HTTP client used by plugins, see hbot.http_client. HTTP/2 needs the optional 'h2' package
+HTTP2: bool = _env_bool("HBOT_HTTP2")
+HTTP_MAX_CONNECTIONS: int = _env_int("HBOT_HTTP_MAX_CONNECTIONS", 100)
+HTTP_MAX_KEEPALIVE: int = _env_int("HBOT_HTTP_MAX_KEEPALIVE", 20)
+HTTP_RETRIES: int = _env_int("HBOT_HTTP_RETRIES", 2)
+
+# How many long running (bulk lane) commands may run at once, see hbot.router.Lane
+BULK_JOBS: int = max(1, _env_int("HBOT_BULK_JOBS", 4))
+
+# Serve handler metrics in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables it
+METRICS_HOST: str = getenv("HBOT_METRICS_HOST") or "127.0.0.1"
+METRICS_PORT: int = _env_int("HBOT_METRICS_PORT", 0)
+
+# Time imports and startup, the profile is logged once the client started. See hbot.startup_profile and
+# `python -m hbot.startup_check`, which fails if loading the bot takes longer than the budget
+PROFILE_STARTUP: bool = _env_bool("HBOT_PROFILE_STARTUP")
+STARTUP_BUDGET: float = _env_float("HBOT_STARTUP_BUDGET", 5.0)
+
+if PROFILE_STARTUP:
+    from hbot import startup_profile
+
+    startup_profile.start()
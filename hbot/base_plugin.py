@@ -1,10 +1,16 @@
 import logging
+from typing import TYPE_CHECKING
 
-from jsondb.database import JsonDB
 from pyrogram.client import Client
 from pyrogram.handlers.handler import Handler
+from pyrogram.types import Message
 
-from hbot import PERSIST_DIR
+from hbot.progress import ProgressTracker
+from hbot.storage import Namespace, storage
+
+# httpx is only imported once a plugin makes a request, plugins that don't use HTTP never pay for it
+if TYPE_CHECKING:
+    from hbot.http_client import SharedHttpClient
 
 logger = logging.getLogger(__name__)
 
@@ -13,33 +19,58 @@ class BasePlugin:
     name: str = "Base Plugin"
     description: str = "Not supposed to be instantiated."
 
+    # When lazy loading is enabled, the plugin's module is only imported the first time one of its commands is
+    # used (and `on_start` only runs then). Set this to False for plugins that must do work at startup (e.g. finishing
+    # a restart).
+    lazy_load: bool = True
+
     # There is no need to change the prefixes in the subclasses. This way, consistency is maintained for every plugins.
     # Unless there's a valid reason of doing so.
-    config = JsonDB(__name__, PERSIST_DIR)
+    config: Namespace = storage.namespace(__name__)
 
-    config.read_database()
-    if isinstance(config.data.get("prefixes"), list):
-        prefixes: list[str] = config.data.get("prefixes")  # type: ignore
+    if isinstance(config.get("prefixes"), list):
+        prefixes: list[str] = config["prefixes"]
     else:
         prefixes: list[str] = ["."]
 
-    # Allow other plugins to change the prefix
-    config.close()
-
     def __init__(self, app: Client) -> None:
         self.app: Client = app
 
+    @property
+    def store(self) -> Namespace:
+        """Persistent key-value data of this plugin, shared by all plugin classes in the same module.
+
+        Reads are served from memory and writes are flushed to disk in the background.
+        """
+        return storage.namespace(type(self).__module__)
+
+    @property
+    def http(self) -> "SharedHttpClient":
+        """Pooled HTTP client shared by all plugins. Do not close it, it is closed when the bot shuts down."""
+        from hbot.http_client import get_http_client
+
+        return get_http_client()
+
+    def progress(self, label: str, message: Message | None = None) -> ProgressTracker:
+        """Throttled progress callback for `download_media`/`reply_document` and the like.
+
+        Progress is logged every few seconds, and `message` (if given) is edited with it at a safe rate.
+        """
+        return ProgressTracker(label, message)
+
     # Allow other plugins to change the prefix
     # TODO: add option to reload all modules and/or restart the bot
     def change_global_prefix(self, prefixes: list[str]) -> None:
         logger.info("changing global prefixes for bot to %s", prefixes)
-        config = JsonDB(__name__, PERSIST_DIR)
+        self.config["prefixes"] = prefixes
 
-        config.read_database()
-        config.data.update({"prefixes": prefixes})
-        config.write_database()
+    async def on_start(self) -> None:
+        """Called once the client is connected, e.g. to warm up caches. Runs in the background, concurrently with
+        the other plugins' `on_start`, so it does not delay the startup. Exceptions are logged.
+        """
 
-        config.close()
+    async def on_stop(self) -> None:
+        """Called before the client disconnects, e.g. to close connections or flush state. Exceptions are logged."""
 
     def register_handlers(self) -> list[Handler]:
         raise NotImplementedError("a plugin must implement this method")
@@ -0,0 +1,271 @@
+"""Offline benchmark: `python -m hbot.bench [--updates N] [--scenario NAME ...] [--json OUT] [--compare BASELINE]`.
+
+Loads the real plugins through `load_plugins` into a stand-in client, replays synthetic streams of messages through
+the handlers the same way pyrogram's dispatcher does (check, then callback) and reports throughput and latency per
+scenario. Nothing talks to Telegram, the solat API is served by a local fake server. Runs use a fixed seed, so the
+JSON output of two commits can be compared with `--compare`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from pyrogram.handlers import MessageHandler
+
+SCENARIOS: tuple[str, ...] = ("chatter", "ping", "ws")
+DEFAULT_UPDATES: int = 20_000
+
+ZONES: list[dict[str, str]] = [
+    {"jakimCode": f"BEN{i:02d}", "negeri": "Bench", "daerah": f"Daerah {i}"} for i in range(1, 11)
+]
+
+
+class FakeMessage:
+    """Just enough of `pyrogram.types.Message` for the router and the plugins used by the scenarios."""
+
+    _next_id: int = 1
+
+    def __init__(self, text: str, outgoing: bool) -> None:
+        FakeMessage._next_id += 1
+        self.id: int = FakeMessage._next_id
+        self.text: str = text
+        self.caption: str | None = None
+        self.outgoing: bool = outgoing
+        self.from_user = SimpleNamespace(id=1, is_self=outgoing, full_name="bench")
+        self.chat = SimpleNamespace(id=-100)
+        self.reply_to_message = None
+        self.media_group_id = None
+        self.command: list[str] | None = None
+        self.edits: int = 0
+
+    async def edit_text(self, text: str, *args: Any, **kwargs: Any) -> "FakeMessage":
+        self.edits += 1
+        return self
+
+    edit = edit_text
+
+    async def delete(self, *args: Any, **kwargs: Any) -> None:
+        return None
+
+    async def reply_document(self, *args: Any, **kwargs: Any) -> "FakeMessage":
+        return self
+
+
+class FakeClient:
+    """Stand-in for `pyrogram.Client` that keeps the handlers and answers every API method with None."""
+
+    def __init__(self) -> None:
+        self.handlers: list[Any] = []
+        self.loop = asyncio.get_running_loop()
+        self.executor = None
+
+    def add_handler(self, handler: Any, group: int = 0) -> tuple[Any, int]:
+        self.handlers.append(handler)
+        return handler, group
+
+    def remove_handler(self, handler: Any, group: int = 0) -> None:
+        self.handlers.remove(handler)
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        async def api_method(*args: Any, **kwargs: Any) -> None:
+            return None
+
+        return api_method
+
+
+async def _fake_api(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Keep-alive HTTP/1.1 server answering like api.waktusolat.app."""
+    try:
+        while request_line := await reader.readline():
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            path = request_line.split()[1].decode().split("?")[0]
+            if path == "/zones":
+                payload: Any = ZONES
+            else:
+                zone = path.split("/")[2]
+                time_ = "05:50:00"
+                payload = {
+                    "prayerTime": {
+                        "hijri": "1447-01-01",
+                        "date": "01-Jan-2026",
+                        "day": "Thursday",
+                        **dict.fromkeys(("fajr", "syuruk", "dhuhr", "asr", "maghrib", "isha"), time_),
+                    },
+                    "status": "OK!",
+                    "serverTime": "2026-01-01 00:00:00",
+                    "periodType": "day",
+                    "lang": "ms_my",
+                    "zone": zone,
+                    "bearing": "292° 32′ 51″",
+                }
+
+            body = json.dumps(payload).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def _stream(scenario: str, count: int, rng: random.Random) -> list[FakeMessage]:
+    words = ["hello", "ok", "lol", "see you tomorrow", "what time is it", "https://example.com", "👍"]
+
+    if scenario == "chatter":
+        # a busy group: mostly other people's messages, some of our own, and a command once in a while
+        messages = []
+        for _ in range(count):
+            roll = rng.random()
+            if roll < 0.01:
+                messages.append(FakeMessage(".ping", outgoing=True))
+            elif roll < 0.05:
+                messages.append(FakeMessage(rng.choice(words), outgoing=True))
+            else:
+                messages.append(FakeMessage(rng.choice(words), outgoing=False))
+        return messages
+
+    if scenario == "ping":
+        return [FakeMessage(".ping", outgoing=True) for _ in range(count)]
+
+    if scenario == "ws":
+        return [
+            FakeMessage(f".ws {rng.choice(ZONES)['jakimCode']} {rng.randint(1, 28)} 1 2026", outgoing=True)
+            for _ in range(count)
+        ]
+
+    raise ValueError(f"unknown scenario: {scenario}")
+
+
+async def _replay(app: FakeClient, messages: list[FakeMessage]) -> dict[str, float]:
+    latencies: list[float] = []
+    handled = 0
+
+    # like the dispatcher, only the handlers for message updates are tried
+    handlers = [h for h in app.handlers if isinstance(h, MessageHandler)]
+
+    start = time.perf_counter()
+    for message in messages:
+        t = time.perf_counter()
+        for handler in handlers:
+            if await handler.check(app, message):
+                await handler.callback(app, message)
+                handled += 1
+                break
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "updates": len(messages),
+        "handled": handled,
+        "seconds": round(elapsed, 4),
+        "updates_per_second": round(len(messages) / elapsed, 1),
+        "p50_us": round(quantiles[49] * 1e6, 2),
+        "p99_us": round(quantiles[98] * 1e6, 2),
+        "max_us": round(max(latencies) * 1e6, 2),
+    }
+
+
+async def _run(scenarios: list[str], updates: int, seed: int) -> dict[str, dict[str, float]]:
+    from hbot.plugins_loader import load_plugins
+    from hbot.storage import Namespace
+
+    app = FakeClient()
+    loaded = load_plugins(app)  # type: ignore
+
+    import hbot.main
+
+    hbot.main.loaded_plugins = loaded
+
+    server = await asyncio.start_server(_fake_api, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    for plugin in loaded:
+        # plugin modules are not in sys.modules, reach the module globals through a function defined in it
+        plugin_globals = type(plugin).register_handlers.__globals__
+        if "API_URL" in plugin_globals:
+            plugin_globals["API_URL"] = f"http://127.0.0.1:{port}"
+
+    results: dict[str, dict[str, float]] = {}
+    for scenario in scenarios:
+        messages = _stream(scenario, updates, random.Random(seed))  # noqa: S311
+        # warm up caches, lazy imports and the connection pool, so only the steady state is measured
+        await _replay(app, _stream(scenario, min(200, updates), random.Random(seed + 1)))  # noqa: S311
+        for plugin in loaded:
+            # start every run with the same cache misses
+            cache = getattr(plugin, "prayer_cache", None)
+            if isinstance(cache, Namespace):
+                cache.clear()
+        results[scenario] = await _replay(app, messages)
+
+    server.close()
+    return results
+
+
+def _print(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]] | None) -> None:
+    print(f"{'scenario':<10} {'updates':>8} {'handled':>8} {'upd/s':>10} {'p50 us':>9} {'p99 us':>9} {'max us':>10}")
+    for scenario, r in results.items():
+        line = (
+            f"{scenario:<10} {r['updates']:>8} {r['handled']:>8} {r['updates_per_second']:>10} "
+            f"{r['p50_us']:>9} {r['p99_us']:>9} {r['max_us']:>10}"
+        )
+        if baseline and scenario in baseline:
+            base = baseline[scenario]
+            change = (r["updates_per_second"] / base["updates_per_second"] - 1) * 100
+            line += f"   throughput {change:+.1f}%, p99 {r['p99_us'] - base['p99_us']:+.2f}us vs baseline"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m hbot.bench", description=__doc__)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="default: all of them")
+    parser.add_argument("--updates", type=int, default=DEFAULT_UPDATES, help="per scenario, default %(default)s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--compare", type=Path, help="results of an earlier run (--json) to compare with")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    scenarios: list[str] = args.scenario or list(SCENARIOS)
+
+    if not args.child:
+        # run in a fresh interpreter with throwaway storage, the plugins write to it while loading and handling
+        with tempfile.TemporaryDirectory() as persist_dir:
+            env = os.environ | {
+                "PERSIST_DIR": persist_dir,
+                "API_ID": os.getenv("API_ID") or "1",
+                "API_HASH": os.getenv("API_HASH") or "bench",
+                "HBOT_LOG_FILE": "0",
+                "HBOT_LOG_LEVEL": os.getenv("HBOT_LOG_LEVEL") or "WARNING",
+                "HBOT_LAZY_PLUGINS": "0",
+            }
+            return subprocess.run([sys.executable, "-m", "hbot.bench", "--child", *sys.argv[1:]], env=env).returncode  # noqa: S603
+
+    from hbot import coloured_logging_setup  # noqa: F401
+
+    results = asyncio.run(_run(scenarios, args.updates, args.seed))
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    _print(results, baseline)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
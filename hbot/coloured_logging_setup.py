@@ -16,30 +16,19 @@
 
 from __future__ import annotations
 
+import atexit
+import copy
 import json
 import logging
 import logging.config
 import os
-from datetime import UTC, datetime
-from logging.handlers import RotatingFileHandler
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Any
 
-
-def _env_bool(name: str, default: bool = False) -> bool:
-    value = os.getenv(name)
-    if value is None:
-        return default
-    return value.strip().lower() in {"1", "true", "yes", "y", "on"}
-
-
-def _env_int(name: str, default: int) -> int:
-    value = os.getenv(name)
-    if value is None:
-        return default
-    try:
-        return int(value)
-    except ValueError:
-        return default
+from hbot import _env_bool, _env_int
+from hbot.tracing import TRACE_FIELDS, install_record_factory
 
 
 class _DropHttpxNoise(logging.Filter):
@@ -66,38 +55,93 @@ class _ColorFormatter(logging.Formatter):
 
 
 class _JsonFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__()
+        # records come in bursts within the same second, so only the fraction changes most of the time
+        self._second: int = -1
+        self._second_text: str = ""
+
+    def _timestamp(self, created: float) -> str:
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1_000_000):06d}Z"
+
     def format(self, record: logging.LogRecord) -> str:
         payload: dict[str, Any] = {
-            "ts": datetime.fromtimestamp(record.created, tz=UTC).isoformat().replace("+00:00", "Z"),
+            "ts": self._timestamp(record.created),
             "level": record.levelname,
             "logger": record.name,
             "msg": record.getMessage(),
         }
 
+        for name in TRACE_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                payload[name] = value
+
         if record.exc_info:
             payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
 
         return json.dumps(payload, ensure_ascii=False)
 
 
+class _QueueHandler(QueueHandler):
+    """Like `QueueHandler`, but keeps the traceback separate from the message, so the handlers behind the queue can
+    format records the same way they do without it."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: QueueListener | None = None
+
+
+def stop_log_listener() -> None:
+    """Write out the records still queued in async mode. Call this before replacing the process (`os.exec*`)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_log_file() -> str | None:
+    """Path of the JSON log file (HBOT_LOG_FILE), or None if logging to a file is disabled."""
+    raw_log_file = os.getenv("HBOT_LOG_FILE")
+    if raw_log_file is None:
+        return "bot.log"
+
+    raw_log_file = raw_log_file.strip()
+    if raw_log_file.lower() in {"", "0", "false", "off", "none"}:
+        return None
+    return raw_log_file
+
+
+def get_log_backups() -> int:
+    """How many rotated log files (`<log file>.1` being the newest) are kept."""
+    return _env_int("HBOT_LOG_BACKUPS", 3)
+
+
 def configure_logging() -> None:
+    global _listener
+    install_record_factory()
     # Backwards-compat: existing env var
     debug = _env_bool("TGBOT_DEBUG")
 
     level = os.getenv("HBOT_LOG_LEVEL", "DEBUG" if debug else "INFO").upper()
 
-    raw_log_file = os.getenv("HBOT_LOG_FILE")
-    if raw_log_file is None:
-        log_file: str | None = "bot.log"
-    else:
-        raw_log_file = raw_log_file.strip()
-        if raw_log_file.lower() in {"", "0", "false", "off", "none"}:
-            log_file = None
-        else:
-            log_file = raw_log_file
-
+    log_file = get_log_file()
     max_bytes = _env_int("HBOT_LOG_MAX_BYTES", 5 * 1024 * 1024)
-    backups = _env_int("HBOT_LOG_BACKUPS", 3)
+    backups = get_log_backups()
 
     use_color = _env_bool("HBOT_LOG_COLOR", default=True) and os.getenv("NO_COLOR") is None
 
@@ -147,7 +191,23 @@ def configure_logging() -> None:
         }
     )
 
-    logging.getLogger(__name__).info("Logging initialized (level=%s, file=%s)", level, log_file or "disabled")
+    # formatting, writing and rolling over the log file happen in a background thread instead of on the event loop
+    use_async = _env_bool("HBOT_LOG_ASYNC")
+    if use_async:
+        root = logging.getLogger()
+        targets = list(root.handlers)
+        log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        for handler in targets:
+            root.removeHandler(handler)
+        root.addHandler(_QueueHandler(log_queue))
+
+        _listener = QueueListener(log_queue, *targets, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_log_listener)
+
+    logging.getLogger(__name__).info(
+        "Logging initialized (level=%s, file=%s, async=%s)", level, log_file or "disabled", use_async
+    )
 
 
 configure_logging()
@@ -0,0 +1,105 @@
+import html
+from dataclasses import dataclass
+
+# Telegram allows 4096 characters per message, leave room for the page footer
+MAX_PAGE_LENGTH: int = 3500
+
+
+@dataclass(slots=True, frozen=True)
+class CommandHelp:
+    plugin: str
+    commands: tuple[str, ...]  # the name first, then its aliases
+    usage: str = ""
+    description: str = ""
+
+    @property
+    def name(self) -> str:
+        return self.commands[0]
+
+
+@dataclass(slots=True, frozen=True)
+class _PluginHelp:
+    name: str
+    description: str
+    commands: tuple[CommandHelp, ...]
+
+
+class HelpRegistry:
+    """Help of every command, recorded by the plugin loader when plugins are (un)registered.
+
+    The rendered pages are cached until a plugin changes, so `.help` does not have to look at the handlers.
+    """
+
+    def __init__(self) -> None:
+        # keyed by "<module>.<class>" of the plugin, which is the same for a lazily indexed plugin and its import
+        self._plugins: dict[str, _PluginHelp] = {}
+        self._commands: dict[str, CommandHelp] = {}
+        self._pages: dict[str, list[str]] = {}
+
+    def set_plugin(self, key: str, name: str, description: str, commands: list[CommandHelp]) -> None:
+        self._plugins[key] = _PluginHelp(name, description, tuple(commands))
+        self._changed()
+
+    def remove_plugin(self, key: str) -> None:
+        if self._plugins.pop(key, None) is not None:
+            self._changed()
+
+    def _changed(self) -> None:
+        self._commands = {c: h for p in self._plugins.values() for h in p.commands for c in h.commands}
+        self._pages.clear()
+
+    def lookup(self, command: str) -> CommandHelp | None:
+        return self._commands.get(command.lower())
+
+    @staticmethod
+    def format_command(help_: CommandHelp, prefix: str) -> str:
+        text = f"<code>{html.escape(prefix + help_.name)}"
+        if help_.usage:
+            text += f" {html.escape(help_.usage)}"
+        text += "</code>"
+        if help_.description:
+            text += f" - {html.escape(help_.description)}"
+        return text
+
+    def describe(self, help_: CommandHelp, prefix: str) -> str:
+        """Everything known about one command, for `.help <command>`."""
+        lines = [self.format_command(help_, prefix), f"plugin: {html.escape(help_.plugin)}"]
+        if len(help_.commands) > 1:
+            lines.append("aliases: " + ", ".join(f"<code>{html.escape(prefix + c)}</code>" for c in help_.commands[1:]))
+        return "\n".join(lines)
+
+    def pages(self, prefix: str) -> list[str]:
+        """The overview of every plugin and command, split into pages of at most `MAX_PAGE_LENGTH` characters."""
+        pages = self._pages.get(prefix)
+        if pages is not None:
+            return pages
+
+        blocks: list[str] = []
+        for plugin in sorted(self._plugins.values(), key=lambda p: p.name.lower()):
+            if not plugin.commands:
+                continue
+            lines = [f"<b>{html.escape(plugin.name)}</b>"]
+            lines += [self.format_command(c, prefix) for c in plugin.commands]
+            blocks.append("\n".join(lines))
+
+        pages = []
+        page = ""
+        for block in blocks:
+            if page and len(page) + len(block) + 2 > MAX_PAGE_LENGTH:
+                pages.append(page)
+                page = ""
+            # a single plugin that does not fit on a page is split between its lines
+            while len(block) > MAX_PAGE_LENGTH:
+                cut = block.rfind("\n", 0, MAX_PAGE_LENGTH)
+                cut = cut if cut > 0 else MAX_PAGE_LENGTH
+                pages.append(block[:cut])
+                block = block[cut:].lstrip("\n")
+            page = f"{page}\n\n{block}" if page else block
+        if page:
+            pages.append(page)
+
+        self._pages[prefix] = pages
+        return pages
+
+
+help_registry: HelpRegistry = HelpRegistry()
@@ -0,0 +1,123 @@
+import asyncio
+import importlib.util
+import logging
+from typing import Any
+
+from httpx import (
+    URL,
+    USE_CLIENT_DEFAULT,
+    AsyncBaseTransport,
+    AsyncClient,
+    AsyncHTTPTransport,
+    ConnectError,
+    ConnectTimeout,
+    Limits,
+    PoolTimeout,
+    Request,
+    Response,
+    Timeout,
+)
+
+from hbot import HTTP2, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_RETRIES
+
+logger = logging.getLogger(__name__)
+
+RETRY_METHODS: frozenset[str] = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES: frozenset[int] = frozenset({429, 502, 503, 504})
+MAX_BACKOFF: float = 30.0  # seconds
+
+
+class RetryTransport(AsyncBaseTransport):
+    """Retry idempotent requests on connection failures and transient status codes, with exponential backoff."""
+
+    def __init__(self, transport: AsyncBaseTransport, retries: int, backoff: float = 0.5) -> None:
+        self.transport: AsyncBaseTransport = transport
+        self.retries: int = retries
+        self.backoff: float = backoff
+
+    def _delay(self, attempt: int, response: Response | None) -> float:
+        delay = self.backoff * (2**attempt)
+
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+
+        return min(delay, MAX_BACKOFF)
+
+    async def handle_async_request(self, request: Request) -> Response:
+        retries = self.retries if request.method in RETRY_METHODS else 0
+
+        for attempt in range(retries + 1):
+            response: Response | None = None
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (ConnectError, ConnectTimeout, PoolTimeout):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+                await response.aclose()
+
+            delay = self._delay(attempt, response)
+            logger.warning(
+                "retrying %s %s in %.1fs (attempt %s/%s)", request.method, request.url, delay, attempt + 1, retries
+            )
+            await asyncio.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class SharedHttpClient(AsyncClient):
+    """An `AsyncClient` that picks its default timeout per host. See `set_host_timeout`."""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.host_timeouts: dict[str, Timeout] = {}
+
+    def set_host_timeout(self, host: str, timeout: float | Timeout) -> None:
+        self.host_timeouts[host] = timeout if isinstance(timeout, Timeout) else Timeout(timeout)
+
+    def build_request(
+        self, method: str, url: URL | str, *, timeout: Any = USE_CLIENT_DEFAULT, **kwargs: Any
+    ) -> Request:
+        if timeout is USE_CLIENT_DEFAULT and self.host_timeouts:
+            host = URL(url).host or self.base_url.host
+            timeout = self.host_timeouts.get(host, USE_CLIENT_DEFAULT)
+
+        return super().build_request(method, url, timeout=timeout, **kwargs)
+
+
+_client: SharedHttpClient | None = None
+
+
+def get_http_client() -> SharedHttpClient:
+    """Return the HTTP client shared by every plugin, creating it on first use."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        return _client
+
+    http2 = HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 was requested but the 'h2' package is not installed, using HTTP/1.1")
+        http2 = False
+
+    limits = Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+    transport = RetryTransport(AsyncHTTPTransport(http2=http2, limits=limits), retries=HTTP_RETRIES)
+
+    logger.info("creating shared http client (http2=%s, limits=%s, retries=%s)", http2, limits, HTTP_RETRIES)
+    _client = SharedHttpClient(transport=transport, timeout=Timeout(30.0, connect=10.0))
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is None:
+        return
+
+    logger.info("closing shared http client")
+    await _client.aclose()
+    _client = None
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+READ_CHUNK_SIZE: int = 64 * 1024
+DURATION_UNITS: dict[str, int] = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def log_files(log_file: str, backups: int) -> list[Path]:
+    """The log file followed by its rotated backups that exist, newest first."""
+    paths = [Path(log_file)] + [Path(f"{log_file}.{i}") for i in range(1, backups + 1)]
+    return [p for p in paths if p.is_file()]
+
+
+def read_lines_backwards(path: Path, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the lines of `path` from last to first, reading it in chunks from the end."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+
+        while position > 0:
+            size = min(chunk_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+
+            # the first piece may be the end of a line that starts in the previous chunk
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+
+        if remainder:
+            yield remainder
+
+
+def parse_since(value: str, now: datetime | None = None) -> datetime | None:
+    """Parse a duration like `30m`, `2h` or `1d` (relative to now) or an ISO date/time. Returns None if invalid."""
+    now = now or datetime.now(UTC)
+    match = re.fullmatch(r"(\d+)([smhdw])", value.strip().lower())
+    if match:
+        return now - timedelta(seconds=int(match[1]) * DURATION_UNITS[match[2]])
+
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+
+@dataclass(slots=True)
+class LogQuery:
+    limit: int = 200
+    level: int = logging.NOTSET
+    pattern: re.Pattern[str] | None = None
+    since: datetime | None = None
+
+
+def _record_time(record: dict[str, Any]) -> datetime | None:
+    try:
+        return datetime.fromisoformat(record["ts"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def format_record(record: dict[str, Any]) -> str:
+    text = f"{record.get('ts', '?')} [{record.get('level', '?')}] {record.get('logger', '?')}: {record.get('msg', '')}"
+    if record.get("exc"):
+        text += f"\n{record['exc']}"
+    return text
+
+
+def tail_records(files: list[Path], query: LogQuery) -> list[str]:
+    """Return up to `query.limit` formatted records matching `query`, oldest first.
+
+    Files are read from the end, newest file first, and reading stops as soon as enough records matched or the
+    records got older than `query.since`, so only the part of the logs that is needed is read.
+    """
+    matched: list[str] = []
+
+    for path in files:
+        for line in read_lines_backwards(path):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # not written by the JSON formatter, keep it unless it has to be filtered by level or time
+                if query.level > logging.NOTSET or query.since is not None:
+                    continue
+                text = line.decode("utf-8", errors="replace")
+            else:
+                if not isinstance(record, dict):
+                    continue
+
+                if query.since is not None:
+                    record_time = _record_time(record)
+                    if record_time is not None and record_time < query.since:
+                        return matched[::-1]
+
+                # getLevelName maps a known level name back to its number
+                levelno = logging.getLevelName(str(record.get("level")))
+                if query.level > logging.NOTSET and (not isinstance(levelno, int) or levelno < query.level):
+                    continue
+                text = format_record(record)
+
+            if query.pattern is not None and not query.pattern.search(text):
+                continue
+
+            matched.append(text)
+            if len(matched) >= query.limit:
+                return matched[::-1]
+
+    return matched[::-1]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import sys
@@ -6,9 +7,20 @@ from pyrogram.client import Client
 from pyrogram.handlers.handler import Handler
 from pyrogram.sync import idle
 
-from hbot import PERSIST_DIR, PLUGINS_DIR
+from hbot import (
+    LAZY_PLUGINS,
+    METRICS_HOST,
+    METRICS_PORT,
+    PERSIST_DIR,
+    PLUGINS_DIR,
+    STARTUP_BUDGET,
+    startup_profile,
+)
 from hbot.base_plugin import BasePlugin
-from hbot.plugins_loader import load_plugins
+from hbot.metrics import start_metrics_server
+from hbot.plugins_loader import load_plugins, start_plugins, stop_plugins
+from hbot.scheduler import scheduler
+from hbot.storage import storage
 
 logger = logging.getLogger(__name__)
 loaded_plugins: dict[BasePlugin, list[Handler]] = {}
@@ -30,14 +42,39 @@ async def get_loaded_plugins() -> dict[BasePlugin, list[Handler]]:
 
 async def main() -> None:
     global loaded_plugins
+    startup_profile.mark("imports done")
     app = Client("hbot", api_id, api_hash)
+    # rate limits outgoing sends, edits and deletes, and is the only place FloodWaits are retried
+    scheduler.install(app)
 
     logger.info("loading plugins from %s", PLUGINS_DIR)
-    loaded_plugins = load_plugins(app, PLUGINS_DIR)
+    loaded_plugins = load_plugins(app, PLUGINS_DIR, lazy=LAZY_PLUGINS)
+    startup_profile.mark("plugins loaded")
 
+    metrics_server: asyncio.Server | None = None
     try:
+        if METRICS_PORT:
+            metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
         await app.start()
+
+        if startup_profile.enabled():
+            elapsed = startup_profile.mark("client started")
+            logger.info("%s", startup_profile.report())
+            if elapsed > STARTUP_BUDGET:
+                logger.warning("startup took %.3fs, over the %.3fs budget", elapsed, STARTUP_BUDGET)
+
+        start_plugins(loaded_plugins)
         await idle()
     finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await stop_plugins(loaded_plugins)
         await app.stop()
+        if "hbot.http_client" in sys.modules:
+            # only imported once a plugin used it, there is nothing to close otherwise
+            from hbot.http_client import close_http_client
+
+            await close_http_client()
+        await storage.aclose()
         sys.exit(0)
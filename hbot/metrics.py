@@ -0,0 +1,200 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.handlers.handler import Handler
+
+from hbot.router import CommandHandler
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+@dataclass(slots=True)
+class Histogram:
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate the `q` quantile by interpolating inside the bucket it falls in, like Prometheus does."""
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+@dataclass(slots=True)
+class HandlerMetrics:
+    plugin: str
+    handler: str
+    calls: int = 0
+    errors: int = 0
+    latency: Histogram = field(default_factory=Histogram)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Call count, error count and latency of every handler, keyed by plugin name and handler (command) name."""
+
+    def __init__(self) -> None:
+        self.handlers: dict[tuple[str, str], HandlerMetrics] = {}
+        self.started: float = time.time()
+
+    def get(self, plugin: str, handler: str) -> HandlerMetrics:
+        key = (plugin, handler)
+        handler_metrics = self.handlers.get(key)
+        if handler_metrics is None:
+            handler_metrics = self.handlers[key] = HandlerMetrics(plugin, handler)
+        return handler_metrics
+
+    def reset(self) -> None:
+        # in place, the instrumented callbacks keep a reference to their entry
+        for handler_metrics in self.handlers.values():
+            handler_metrics.calls = handler_metrics.errors = 0
+            handler_metrics.latency = Histogram()
+        self.started = time.time()
+
+    def instrument(self, handler: Handler, plugin: str) -> None:
+        """Wrap the callback of `handler` so every call is recorded under `plugin`."""
+        if isinstance(handler, CommandHandler):
+            name = handler.commands[0]
+        else:
+            name = f"{type(handler).__name__}:{getattr(handler.callback, '__name__', '?')}"
+
+        handler_metrics = self.get(plugin, name)
+        callback: Callable = handler.callback
+
+        def record(start: float, error: bool) -> None:
+            handler_metrics.calls += 1
+            handler_metrics.errors += error
+            handler_metrics.latency.observe(time.perf_counter() - start)
+
+        if inspect.iscoroutinefunction(callback):
+
+            @functools.wraps(callback)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start, error = time.perf_counter(), True
+                try:
+                    result = await callback(*args, **kwargs)
+                    error = False
+                    return result
+                except (StopPropagation, ContinuePropagation):
+                    error = False
+                    raise
+                finally:
+                    record(start, error)
+
+            handler.callback = async_wrapper
+        else:
+
+            @functools.wraps(callback)
+            def sync_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start, error = time.perf_counter(), True
+                try:
+                    result = callback(*args, **kwargs)
+                    error = False
+                    return result
+                except (StopPropagation, ContinuePropagation):
+                    error = False
+                    raise
+                finally:
+                    record(start, error)
+
+            handler.callback = sync_wrapper
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP hbot_handler_calls_total Handler calls.",
+            "# TYPE hbot_handler_calls_total counter",
+        ]
+        for m in self.handlers.values():
+            lines.append(
+                f'hbot_handler_calls_total{{plugin="{_escape(m.plugin)}",handler="{_escape(m.handler)}"}} {m.calls}'
+            )
+
+        lines += [
+            "# HELP hbot_handler_errors_total Handler calls that raised.",
+            "# TYPE hbot_handler_errors_total counter",
+        ]
+        for m in self.handlers.values():
+            lines.append(
+                f'hbot_handler_errors_total{{plugin="{_escape(m.plugin)}",handler="{_escape(m.handler)}"}} {m.errors}'
+            )
+
+        lines += [
+            "# HELP hbot_handler_duration_seconds Handler latency.",
+            "# TYPE hbot_handler_duration_seconds histogram",
+        ]
+        for m in self.handlers.values():
+            labels = f'plugin="{_escape(m.plugin)}",handler="{_escape(m.handler)}"'
+            cumulative = 0
+            for bound, count in zip((*m.latency.buckets, "+Inf"), m.latency.counts, strict=True):
+                cumulative += count
+                lines.append(f'hbot_handler_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"hbot_handler_duration_seconds_sum{{{labels}}} {m.latency.total}")
+            lines.append(f"hbot_handler_duration_seconds_count{{{labels}}} {m.latency.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics: MetricsRegistry = MetricsRegistry()
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # the rest of the request is not needed
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", metrics.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (TimeoutError, ConnectionError) as e:
+        logger.debug("metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    """Serve the metrics in the Prometheus text format on `http://host:port/metrics`."""
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info("serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -1,19 +1,123 @@
+import asyncio
+import hashlib
+import importlib
 import logging
 import os
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
 from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING
 
-from google import genai
-from google.genai import types
-from pyrogram import filters
 from pyrogram.client import Client
+from pyrogram.errors import RPCError
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
 from pyrogram.types import Message
 
 from hbot.base_plugin import BasePlugin
+from hbot.router import CommandHandler, Lane
+from hbot.storage import Namespace, storage
+from hbot.tracing import span
+
+# google.genai takes around two seconds to import, it is only imported once a prompt is actually sent
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
 logger = logging.getLogger(__name__)
 
+MODEL: str = "gemini-2.5-flash"
+MAX_MESSAGE_LENGTH: int = 4096
+
+# minimum time between two edits of the answer while it is being streamed, to stay clear of flood limits
+STREAM_EDIT_INTERVAL: float = 1.5  # seconds
+
+ERROR_TEXT: str = "error when generating response, see log for more info"
+NO_CACHE_FLAGS: tuple[str, ...] = ("-n", "--no-cache")
+
+
+class ResponseCache:
+    """Answers keyed by a hash of the normalized prompt, model and generation config.
+
+    A small LRU is kept in memory, in front of a persistent store that is capped by total size (oldest
+    entries are evicted first). Entries older than `ttl` seconds are ignored.
+    """
+
+    def __init__(
+        self, store: Namespace, max_entries: int = 128, max_bytes: int = 2 * 1024 * 1024, ttl: int = 86400
+    ) -> None:
+        self.store: Namespace = store
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.ttl: int = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        # key -> (text, created)
+        self._lru: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._size: int = sum(len(v["text"].encode()) for v in store.values())
+
+    @staticmethod
+    def key(prompt: str, model: str, config: "types.GenerateContentConfig") -> str:
+        normalized = " ".join(unicodedata.normalize("NFC", prompt).split())
+        material = "\0".join((model, config.model_dump_json(exclude_none=True), normalized))
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        cached = self._lru.get(key)
+        if cached is not None:
+            text, created = cached
+            if created + self.ttl >= time.time():
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return text
+            del self._lru[key]
+
+        entry = self.store.get(key)
+        if entry is None or entry["created"] + self.ttl < time.time():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(key, entry["text"], entry["created"])
+        return entry["text"]
+
+    def put(self, key: str, text: str) -> None:
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+
+        if key in self.store:
+            self._size -= len(self.store[key]["text"].encode())
+
+        created = time.time()
+        self.store[key] = {"text": text, "created": created}
+        self._size += size
+        self._remember(key, text, created)
+
+        if self._size > self.max_bytes:
+            for old_key in sorted(self.store, key=lambda k: self.store[k]["created"]):
+                if self._size <= self.max_bytes:
+                    break
+                self._size -= len(self.store[old_key]["text"].encode())
+                del self.store[old_key]
+                self._lru.pop(old_key, None)
+
+    def _remember(self, key: str, text: str, created: float) -> None:
+        self._lru[key] = (text, created)
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def clear(self) -> None:
+        self._lru.clear()
+        for key in list(self.store):
+            del self.store[key]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self.store)
+
 
 class Gemini(BasePlugin):
     name: str = "Gemini Plugin"
@@ -21,6 +125,37 @@ class Gemini(BasePlugin):
 
     def __init__(self, app: Client) -> None:
         self.app: Client = app
+        self._client: genai.Client | None = None
+        self._generate_config: types.GenerateContentConfig | None = None
+        self.response_cache: ResponseCache = ResponseCache(storage.namespace(f"{self.store.name}.responses"))
+
+    @property
+    def client(self) -> "genai.Client":
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(api_key=os.getenv(key="GEMINI_API_KEY"))
+        return self._client
+
+    @property
+    def generate_config(self) -> "types.GenerateContentConfig":
+        if self._generate_config is None:
+            from google.genai import types
+
+            self._generate_config = types.GenerateContentConfig(temperature=1.0)
+        return self._generate_config
+
+    async def on_start(self) -> None:
+        if os.getenv(key="GEMINI_API_KEY") is None:
+            return
+
+        # import google.genai and create the client in a thread now, instead of making the first .ask wait for it
+        await asyncio.to_thread(lambda: self.client)
+
+    async def on_stop(self) -> None:
+        if self._client is not None:
+            await self._client.aio.aclose()
+            self._client.close()
 
     async def search_handler(self, client: Client, message: Message) -> None:
         if os.getenv(key="GEMINI_API_KEY") is None:
@@ -29,42 +164,124 @@ class Gemini(BasePlugin):
             return
 
         parts = message.text.split(maxsplit=1)  # type: ignore
+        use_cache = True
+        if len(parts) > 1 and parts[1].split(maxsplit=1)[0] in NO_CACHE_FLAGS:
+            use_cache = False
+            parts = parts[1].split(maxsplit=1)
+
         if len(parts) > 1:
+            if "google.genai" not in sys.modules:
+                # the first import is slow, don't block the loop with it
+                await asyncio.to_thread(importlib.import_module, "google.genai")
+
             prompt = parts[1]
+            cache_key = self.response_cache.key(prompt, MODEL, self.generate_config)
+
+            cached = self.response_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                logger.info("answering from response cache")
+                if len(cached) > MAX_MESSAGE_LENGTH:
+                    await self._send_as_file(message, cached)
+                else:
+                    await message.edit_text(cached)
+                return
+
             await message.edit("Asking..")
             try:
-                # Call the async helper
-                response_text = await self.ask_gemini(prompt)
-                if len(response_text) > 4096:
-                    await message.edit_text("response too long, sending as file")
-                    with NamedTemporaryFile("w+", encoding="utf-8", suffix=".md") as f:
-                        f.write(response_text)
-                        f.flush()
-                        await message.reply_document(f.name)
-                else:
-                    await message.edit_text(response_text)
+                response_text = await self.stream_gemini(prompt, message)
+                if response_text != ERROR_TEXT:
+                    self.response_cache.put(cache_key, response_text)
+                if len(response_text) > MAX_MESSAGE_LENGTH:
+                    await self._send_as_file(message, response_text)
             except TimeoutError as e:
                 logging.exception("Gemini Error:")
                 await message.edit(f"Error: {str(e)}")
         else:
             await message.edit("Please provide a search query!")
 
-    async def ask_gemini(self, text_to_be_ask) -> str:
-        api_key = os.getenv(key="GEMINI_API_KEY")
-        client = genai.Client(api_key=api_key)
-        config = types.GenerateContentConfig(temperature=1.0)
+    async def cache_handler(self, client: Client, message: Message) -> None:
+        parts = message.text.split()  # type: ignore
+        if len(parts) > 1 and parts[1] == "clear":
+            self.response_cache.clear()
+            await message.edit_text("__response cache cleared__")
+            return
+
+        cache = self.response_cache
+        await message.edit_text(
+            f"__response cache: {len(cache)} entries, {cache.hits} hits, {cache.misses} misses__\n"
+            f"__use `.askcache clear` to clear it, or `.ask -n <prompt>` to bypass it__"
+        )
+
+    async def _send_as_file(self, message: Message, text: str) -> None:
+        await message.edit_text("response too long, sending as file")
+        with NamedTemporaryFile("w+", encoding="utf-8", suffix=".md") as f:
+            f.write(text)
+            f.flush()
+            await message.reply_document(f.name)
 
+    @staticmethod
+    async def _edit_progress(message: Message, text: str) -> bool:
+        """Show a partial answer. A failed edit (flood wait, not modified...) must not fail the answer."""
         try:
-            response = await client.aio.models.generate_content(
-                model="gemini-2.5-flash", contents=text_to_be_ask, config=config
-            )
-            if response.text is None:
-                raise
+            await message.edit_text(text)
+        except RPCError as e:
+            logger.warning("could not show partial answer: %s", e)
+            return False
+        return True
+
+    async def stream_gemini(self, text_to_be_ask: str, message: Message) -> str:
+        """Stream the answer into `message`, editing it at most once every `STREAM_EDIT_INTERVAL` seconds.
+
+        Once the answer no longer fits in a message, editing stops and the full text is returned so the caller
+        can send it as a file instead.
+        """
+        text: str = ""
+        shown: str = ""
+        last_edit: float = 0.0
+        too_long: bool = False
+
+        try:
+            with span("api_call", model=MODEL):
+                async for chunk in await self.client.aio.models.generate_content_stream(
+                    model=MODEL, contents=text_to_be_ask, config=self.generate_config
+                ):
+                    text += chunk.text or ""
+
+                    if len(text) > MAX_MESSAGE_LENGTH:
+                        if not too_long:
+                            too_long = True
+                            await self._edit_progress(
+                                message, "__response is long, it will be sent as a file once finished__"
+                            )
+                        continue
+
+                    if text and text != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                        # also wait before the next try if the edit failed, e.g. during a flood wait
+                        if await self._edit_progress(message, text):
+                            shown = text
+                        last_edit = time.monotonic()
         except Exception:
             logger.exception("error when generating response, traceback:")
-            return "error when generating response, see log for more info"
+            text = ERROR_TEXT
+            too_long = False
+
+        if not text:
+            text = ERROR_TEXT
+
+        if not too_long and text != shown:
+            await message.edit_text(text)
 
-        return response.text
+        return text
 
     def register_handlers(self) -> list[Handler]:
-        return [MessageHandler(self.search_handler, filters.command("ask", prefixes=self.prefixes) & filters.me)]
+        return [
+            CommandHandler(
+                self.search_handler,
+                "ask",
+                usage="[-n] <prompt>",
+                description="ask Gemini, -n skips the cache",
+                limit=3,
+                lane=Lane.BULK,
+            ),
+            CommandHandler(self.cache_handler, "askcache", usage="[clear]", description="response cache statistics"),
+        ]
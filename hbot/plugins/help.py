@@ -1,14 +1,14 @@
+import html
 import logging
-from typing import cast
 
-from pyrogram import filters
 from pyrogram.client import Client
+from pyrogram.enums import ParseMode
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
 from pyrogram.types.messages_and_media import Message
 
 from hbot.base_plugin import BasePlugin
-from hbot.main import get_loaded_plugins
+from hbot.help_registry import help_registry
+from hbot.router import CommandHandler
 
 logger = logging.getLogger(__name__)
 
@@ -21,23 +21,41 @@ class MyPlugin(BasePlugin):
         self.app: Client = app
 
     async def help(self, app: Client, message: Message) -> None:
-        loaded_plugins: dict[BasePlugin, list[Handler]] = await get_loaded_plugins()
-        help_string: str = ""
-
-        # This whole thing is very hacky because pyrogram does not provide
-        # an easy way to access the bound handler/filter. I had to study the
-        # pyrogram's source code just to write this.
-        for plugin, handlers in loaded_plugins.items():
-            help_string += f"**Plugin: {plugin.name}**\n"
-            for h in handlers:
-                for x in (h.filters.base, h.filters.other):  # type: ignore
-                    if type(x).__name__ == "CommandFilter":
-                        x.commands = cast(set, x.commands)
-                        help_string += "\n".join(x.commands) + "\n"
-
-            help_string += "\n"
-
-        await message.edit_text(help_string)
+        args: list[str] = message.text.split()[1:]  # type: ignore
+        prefix: str = self.prefixes[0]
+
+        if args and not args[0].isdigit():
+            command: str = args[0].removeprefix(prefix)
+            command_help = help_registry.lookup(command)
+            if command_help is None:
+                await message.edit_text(f"__no such command: {command}__", parse_mode=ParseMode.MARKDOWN)
+                return
+
+            await message.edit_text(help_registry.describe(command_help, prefix), parse_mode=ParseMode.HTML)
+            return
+
+        pages: list[str] = help_registry.pages(prefix)
+        if not pages:
+            await message.edit_text("__no commands are loaded__")
+            return
+
+        page: int = int(args[0]) if args else 1
+        if not 1 <= page <= len(pages):
+            await message.edit_text(f"__page must be between 1 and {len(pages)}__")
+            return
+
+        text: str = pages[page - 1]
+        if len(pages) > 1:
+            footer = f"page {page}/{len(pages)}"
+            if page < len(pages):
+                footer += f", <code>{html.escape(prefix)}help {page + 1}</code> for the next one"
+            text += f"\n\n<i>{footer}</i>"
+
+        await message.edit_text(text, parse_mode=ParseMode.HTML)
 
     def register_handlers(self) -> list[Handler]:
-        return [MessageHandler(self.help, filters.command("help", prefixes=self.prefixes) & filters.me)]
+        return [
+            CommandHandler(
+                self.help, "help", usage="[page | command]", description="list the commands, or show one in detail"
+            )
+        ]
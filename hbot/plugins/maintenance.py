@@ -1,41 +1,116 @@
 import asyncio
+import gzip
+import html
 import logging
 import os
+import re
+import shlex
 import shutil
-import subprocess
+import tempfile
 import time
-from functools import partial
+from collections.abc import Awaitable, Callable
 
 from anyio import Path
-from jsondb.database import JsonDB
-from pyrogram import filters
 from pyrogram.client import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import RPCError
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
 from pyrogram.types.messages_and_media import Message
 
-from hbot import PERSIST_DIR
 from hbot.base_plugin import BasePlugin
+from hbot.coloured_logging_setup import get_log_backups, get_log_file, stop_log_listener
+from hbot.log_reader import LogQuery, log_files, parse_since, tail_records
+from hbot.main import get_loaded_plugins
+from hbot.plugins_loader import reload_plugin
+from hbot.process import ProcessResult, run_process
+from hbot.router import CommandHandler, Lane
+from hbot.storage import storage
 
 logger = logging.getLogger(__name__)
-db = JsonDB(__name__, PERSIST_DIR)
 update_lock: asyncio.Lock = asyncio.Lock()
 
+SHELL_TIMEOUT: float = 10 * 60  # seconds
+UPDATE_TIMEOUT: float = 2 * 60  # seconds
+OUTPUT_EDIT_INTERVAL: float = 3.0  # seconds
+# output that doesn't fit in a message (with some room for the status line) is uploaded as a file
+MAX_INLINE_OUTPUT: int = 3800
+
+GETLOG_DEFAULT_LINES: int = 200
+GETLOG_MAX_LINES: int = 100_000
+
+
+def _write_gzip(path: str, text: str) -> None:
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(text)
+
 
 class MaintenancePlugin(BasePlugin):
     name: str = "Maintenance Plugin"
     description: str = "This plugin is for performing maintenance for the userbot, e.g. updating it."
+    lazy_load: bool = False
 
     def __init__(self, app: Client) -> None:
         self.app: Client = app
+        self.running_shells: set[asyncio.Task] = set()
+
+    def _output_streamer(self, message: Message, header: str) -> Callable[[str], Awaitable[None]]:
+        """Return an `on_output` callback for `run_process` that shows the latest output in `message`."""
+        tail: str = ""
+        last_edit: float = time.monotonic()
+
+        async def on_output(text: str) -> None:
+            nonlocal tail, last_edit
+            tail = (tail + text)[-MAX_INLINE_OUTPUT:]
+            if time.monotonic() - last_edit < OUTPUT_EDIT_INTERVAL:
+                return
+
+            last_edit = time.monotonic()
+            try:
+                await message.edit_text(
+                    f"<i>{html.escape(header)}</i>\n<pre>{html.escape(tail)}</pre>", parse_mode=ParseMode.HTML
+                )
+            except RPCError as e:
+                logger.debug("could not edit output message: %s", e)
+
+        return on_output
+
+    async def _show_result(self, message: Message, result: ProcessResult) -> None:
+        if result.timed_out:
+            status = f"killed after timing out, took {result.duration:.2f}s"
+        else:
+            status = f"exit code {result.returncode}, took {result.duration:.2f}s"
+
+        if result.output_file is None and len(result.output) <= MAX_INLINE_OUTPUT:
+            await message.edit_text(
+                f"<pre>{html.escape(result.output) or '(no output)'}</pre>\n<i>{status}</i>", parse_mode=ParseMode.HTML
+            )
+            return
+
+        output_file = result.output_file
+        if output_file is None:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as f:
+                f.write(result.output)
+            output_file = Path(f.name)
+
+        try:
+            await message.edit_text(
+                f"<pre>{html.escape(result.output[-1000:])}</pre>\n<i>{status}, full output attached</i>",
+                parse_mode=ParseMode.HTML,
+            )
+            await message.reply_document(str(output_file), file_name="output.txt")
+        finally:
+            await Path(output_file).unlink(missing_ok=True)
 
     def _perform_restart(self, message: Message) -> None:
         begin_time = time.time()
-        db.data["begin_time"] = begin_time
-        db.data["chat_id"] = message.chat.id  # type: ignore
-        db.data["message_id"] = message.id
-        db.data["restart"] = True
-        db.write_database()
+        self.store["begin_time"] = begin_time
+        self.store["chat_id"] = message.chat.id  # type: ignore
+        self.store["message_id"] = message.id
+        self.store["restart"] = True
+
+        # os.execl replaces the process, so nothing pending in the background flush or the log queue would survive it
+        storage.flush_sync()
+        stop_log_listener()
 
         uv_path: str = shutil.which("uv") or "/usr/bin/uv"  # fallback to hardcoded path
         os.execl(uv_path, "uv", "run", "python3", "-m", "hbot")  # noqa: S606
@@ -60,115 +135,195 @@ class MaintenancePlugin(BasePlugin):
             await message.edit_text("__running git pull__")
 
             git_path: str = shutil.which("git") or "/usr/bin/git"  # fallback to hardcoded path
-
-            # unfortunately, asyncio.create_subprocess_exec cannot be used here because this bot
-            # uses uvloop, and the aforementioned function is broken with uvloop. we have to resort
-            # to this workaround, which work just as well
-            partial_func = partial(
-                subprocess.run,
+            result: ProcessResult = await run_process(
                 [git_path, "pull", "--rebase"],
-                capture_output=True,
+                timeout=UPDATE_TIMEOUT,
+                on_output=self._output_streamer(message, "running git pull"),
             )
-            result: subprocess.CompletedProcess = await asyncio.get_running_loop().run_in_executor(
-                None,
-                partial_func,
-            )
-            if result.returncode != 0:
-                await message.edit_text(f"__error when running git pull__, {str(result.stderr.decode())}")
+            if not result.ok:
+                await self._show_result(message, result)
                 return
 
-            if result.stdout.decode() == "Already up to date.\n":
+            if "Already up to date." in result.output:
                 await message.edit_text("__bot is already up to date__")
                 return
 
             await message.edit_text("__restarting the bot__")
-            db.data["update_changelog"] = result.stdout.decode()
+            self.store["update_changelog"] = result.output
             self._perform_restart(message)
 
     async def shell(self, app: Client, message: Message) -> None:
+        args: list[str] = message.text.split(maxsplit=1)[1:]  # type: ignore
+        timeout: float = SHELL_TIMEOUT
+        if args and args[0].startswith("-t "):
+            _, seconds, *rest = args[0].split(maxsplit=2)
+            if not seconds.isdigit() or not rest:
+                args = []
+            else:
+                timeout, args = int(seconds), rest
+
+        if not args:
+            await message.edit_text("__syntax: .shell [-t timeout seconds] <command>, .shellcancel stops it__")
+            return
+
+        command: str = args[0]
         sh_path: str = shutil.which("sh") or "/usr/bin/sh"  # fallback to hardcoded path
+        await message.edit_text(f"__running (timeout {timeout:.0f}s)__")
 
-        partial_func = partial(
-            subprocess.run,
-            [sh_path, "-c", message.text.removeprefix(".shell").strip()],  # type: ignore
-            capture_output=True,
-        )
-        result: subprocess.CompletedProcess = await asyncio.get_running_loop().run_in_executor(
-            None,
-            partial_func,
+        # run it in its own task, cancelling the handler itself would take down a dispatcher worker
+        task: asyncio.Task[ProcessResult] = asyncio.get_running_loop().create_task(
+            run_process([sh_path, "-c", command], timeout=timeout, on_output=self._output_streamer(message, command))
         )
+        self.running_shells.add(task)
+        try:
+            result: ProcessResult = await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if current is not None and current.cancelling():
+                raise
+            await message.edit_text("__cancelled__")
+            return
+        finally:
+            self.running_shells.discard(task)
 
-        await message.edit_text(f"stdout:\n{result.stdout.decode()}\n\nstderr:\n{result.stderr.decode()}\n")
+        await self._show_result(message, result)
 
-    async def getlog(self, app: Client, message: Message) -> None:
-        await message.edit_text("__uploading log__")
+    async def shell_cancel(self, app: Client, message: Message) -> None:
+        count = len(self.running_shells)
+        for task in self.running_shells:
+            task.cancel()
+        await message.edit_text(f"__cancelled {count} running command(s)__")
 
-        logger.info("opening log file")
-        log_file: Path = Path("bot.log")
+    async def reload(self, app: Client, message: Message) -> None:
+        parts: list[str] = message.text.split(maxsplit=1)  # type: ignore
+        if len(parts) < 2:
+            await message.edit_text("__syntax: .reload <plugin file name, e.g. ziptools>__")
+            return
 
-        logger.info("checking log file existence")
-        if not await log_file.exists():
-            logger.warning("log file does not exist")
-            await message.edit_text("__cannot locate log file!__")
+        plugin: str = parts[1].strip().removesuffix(".py")
+        if not plugin.isidentifier():
+            await message.edit_text("__the plugin name must be a file name in the plugins directory, e.g. ziptools__")
             return
 
-        logger.info("log file exists")
+        await message.edit_text(f"__reloading {plugin}__")
 
-        async with await log_file.open("r", encoding="utf-8") as f:
-            logger.info("open succeeds, uploading")
-            await message.reply_document(f.wrapped.name)
+        start_time = time.perf_counter()
+        try:
+            reloaded = await reload_plugin(app, await get_loaded_plugins(), plugin)
+        except Exception as e:
+            logger.exception("failed to reload plugin '%s'", plugin)
+            await message.edit_text(f"__failed to reload {plugin}:__ `{e}`")
+            return
 
-        logger.info("finished")
-        await message.edit_text("__done__")
+        duration = time.perf_counter() - start_time
+        names: str = ", ".join(p.name for p in reloaded) or "nothing"
+        await message.edit_text(f"__reloaded {names}, took {duration * 1000:.1f}ms__")
 
-    def register_handlers(self) -> list[Handler]:
-        end_time = time.time()
-        db.read_database()
+    async def getlog(self, app: Client, message: Message) -> None:
+        syntax = "__syntax: .getlog [-n lines] [--level LEVEL] [--grep regex] [--since 30m|2h|1d|ISO time]__"
+        try:
+            args: list[str] = shlex.split(message.text)[1:]  # type: ignore
+        except ValueError:
+            await message.edit_text(syntax)
+            return
+
+        query = LogQuery(limit=GETLOG_DEFAULT_LINES)
+        while args:
+            option = args.pop(0)
+            value = args.pop(0) if args else ""
+            if option == "-n" and value.isdigit() and 0 < int(value) <= GETLOG_MAX_LINES:
+                query.limit = int(value)
+            elif option == "--level" and isinstance(logging.getLevelName(value.upper()), int):
+                query.level = logging.getLevelName(value.upper())
+            elif option == "--grep" and value:
+                try:
+                    query.pattern = re.compile(value, re.IGNORECASE)
+                except re.error as e:
+                    await message.edit_text(f"__invalid regex: {e}__")
+                    return
+            elif option == "--since" and (since := parse_since(value)) is not None:
+                query.since = since
+            else:
+                await message.edit_text(syntax)
+                return
+
+        log_file = get_log_file()
+        if log_file is None:
+            await message.edit_text("__logging to a file is disabled (HBOT_LOG_FILE)__")
+            return
+
+        files = log_files(log_file, get_log_backups())
+        if not files:
+            logger.warning("log file does not exist")
+            await message.edit_text("__cannot locate log file!__")
+            return
 
+        await message.edit_text("__reading log__")
         loop = asyncio.get_running_loop()
+        records: list[str] = await loop.run_in_executor(None, tail_records, files, query)
+        if not records:
+            await message.edit_text("__no matching log records__")
+            return
 
-        restart_status: bool = db.data.get("restart", False)
-        update_changelog: str = db.data.get("update_changelog", "")
-        restart_time_delta: float = end_time - db.data.get("begin_time", 0)
+        text = "\n".join(records)
+        if len(text) <= MAX_INLINE_OUTPUT:
+            await message.edit_text(f"<pre>{html.escape(text)}</pre>", parse_mode=ParseMode.HTML)
+            return
 
-        if restart_status:
-            logger.info("attempting to finish restart")
-            task = loop.create_task(self.app.connect())
+        await message.edit_text(f"__uploading {len(records)} log records__")
+        with tempfile.TemporaryDirectory() as d:
+            archive = os.path.join(d, f"{os.path.basename(log_file)}.gz")
+            await loop.run_in_executor(None, _write_gzip, archive, text)
+            await message.reply_document(archive)
 
-            def done_callback(*args, **kwargs) -> None:
-                update_text = (
-                    f"__bot{' updated and ' if update_changelog else ' '}restarted successfully, took "
-                    f"{restart_time_delta:.2f}s__\n"
-                    f"{update_changelog}"
-                )
-                loop.create_task(
-                    self.app.edit_message_text(
-                        db.data["chat_id"],
-                        db.data["message_id"],
-                        update_text,
-                    )
-                )
+        await message.edit_text(f"__sent the last {len(records)} matching log records__")
+
+    async def on_start(self) -> None:
+        if not self.store.get("restart", False):
+            return
 
-            task.add_done_callback(done_callback)
+        logger.info("finishing restart")
+        restart_time_delta: float = time.time() - self.store.get("begin_time", 0)
+        update_changelog: str = self.store.get("update_changelog", "")
+        self.store["update_changelog"] = ""
+        self.store["restart"] = False
+
+        await self.app.edit_message_text(
+            self.store["chat_id"],
+            self.store["message_id"],
+            f"__bot{' updated and ' if update_changelog else ' '}restarted successfully, took "
+            f"{restart_time_delta:.2f}s__\n"
+            f"{update_changelog}",
+        )
 
-            db.data["update_changelog"] = ""
-            db.data["restart"] = False
+    async def on_stop(self) -> None:
+        # cancelling kills the process group, nothing should keep running once the bot is gone
+        for task in self.running_shells:
+            task.cancel()
+        await asyncio.gather(*self.running_shells, return_exceptions=True)
 
+    def register_handlers(self) -> list[Handler]:
         return [
-            MessageHandler(
-                self.update,
-                filters.command("update", prefixes=self.prefixes) & filters.me,
-            ),
-            MessageHandler(
-                self.restart,
-                filters.command("restart", prefixes=self.prefixes) & filters.me,
+            CommandHandler(
+                self.update, "update", description="git pull and restart if anything changed", lane=Lane.BULK
             ),
-            MessageHandler(
+            CommandHandler(self.restart, "restart", description="restart the bot"),
+            CommandHandler(
                 self.shell,
-                filters.command("shell", prefixes=self.prefixes) & filters.me,
+                "shell",
+                usage="[-t seconds] <command>",
+                description="run a shell command",
+                limit=2,
+                lane=Lane.BULK,
             ),
-            MessageHandler(
+            CommandHandler(self.shell_cancel, "shellcancel", description="stop the running shell commands"),
+            CommandHandler(
                 self.getlog,
-                filters.command("getlog", prefixes=self.prefixes) & filters.me,
+                "getlog",
+                usage="[-n lines] [--level LEVEL] [--grep regex] [--since 30m|2h|1d|ISO time]",
+                description="show the latest log records",
+                limit=1,
+                lane=Lane.BULK,
             ),
+            CommandHandler(self.reload, "reload", usage="<plugin file name>", description="reload a plugin from disk"),
         ]
@@ -1,16 +1,63 @@
 import asyncio
 import logging
+import time
+from collections.abc import Awaitable, Callable
 
-from pyrogram import filters
 from pyrogram.client import Client
+from pyrogram.enums import ChatMemberStatus, ChatType
+from pyrogram.errors import ChatAdminRequired, RPCError, UserNotParticipant
+from pyrogram.handlers import ChatMemberUpdatedHandler
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
+from pyrogram.types import Chat, ChatMemberUpdated
 from pyrogram.types.messages_and_media import Message
 
 from hbot.base_plugin import BasePlugin
+from hbot.router import CommandHandler, Lane
 
 logger = logging.getLogger(__name__)
 
+# Telegram deletes at most 100 messages per call
+DELETE_CHUNK_SIZE: int = 100
+DELETE_CONCURRENCY: int = 4
+PURGE_PROGRESS_INTERVAL: float = 5.0  # seconds
+
+# how long our own admin status in a chat is trusted, updates about our membership invalidate it earlier
+ADMIN_CACHE_TTL: float = 10 * 60  # seconds
+
+
+async def delete_messages_bulk(
+    app: Client,
+    chat_id: int,
+    message_ids: list[int],
+    concurrency: int = DELETE_CONCURRENCY,
+    on_progress: Callable[[int, int], Awaitable[None]] | None = None,
+) -> int:
+    """Delete `message_ids` in chunks, with up to `concurrency` chunks in flight. Returns how many were deleted.
+
+    FloodWaits are handled by the scheduler (`hbot.scheduler`), which pauses every deletion until it expires and
+    retries. Chunks that fail anyway are logged and skipped. `on_progress(processed, total)` is awaited after each
+    chunk.
+    """
+    chunks = iter([message_ids[i : i + DELETE_CHUNK_SIZE] for i in range(0, len(message_ids), DELETE_CHUNK_SIZE)])
+    deleted: int = 0
+    processed: int = 0
+
+    async def worker() -> None:
+        nonlocal deleted, processed
+        for chunk in chunks:
+            try:
+                count = await app.delete_messages(chat_id, chunk)
+                deleted += count
+            except RPCError as e:
+                logger.warning("failed to delete messages %s-%s: %s", chunk[0], chunk[-1], e)
+
+            processed += len(chunk)
+            if on_progress is not None:
+                await on_progress(processed, len(message_ids))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return deleted
+
 
 class ModPlugin(BasePlugin):
     name: str = "Moderation Plugin"
@@ -18,39 +65,91 @@ class ModPlugin(BasePlugin):
 
     def __init__(self, app: Client) -> None:
         self.app: Client = app
+        # chat id -> (expiry, admin status)
+        self.admin_cache: dict[int, tuple[float, bool]] = {}
 
-    async def _is_admin(self, app: Client, chat_id: int) -> bool:
-        logger.info("checking admin status")
-        admin_status: bool | None = (await app.get_chat(chat_id)).is_admin
+    async def _is_admin(self, app: Client, chat: Chat) -> bool:
+        if chat.type in (ChatType.PRIVATE, ChatType.BOT):
+            # no admins in private chats, messages of both sides can be deleted anyway
+            return True
 
-        # it can also be None is it's private chat, for the sake of simplicity,
-        # we return True
-        logger.info("admin status: %s", admin_status)
-        if admin_status or admin_status is None:
+        assert chat.id is not None
+        chat_id: int = chat.id
+        cached = self.admin_cache.get(chat_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        logger.info("checking admin status")
+        try:
+            member = await app.get_chat_member(chat_id, "me")
+        except UserNotParticipant:
+            member = None
+            is_admin = False
+        else:
+            if member.status == ChatMemberStatus.OWNER:
+                is_admin = True
+            elif member.status == ChatMemberStatus.ADMINISTRATOR:
+                # admins of basic groups have no privileges listed, they can all delete messages
+                is_admin = member.privileges is None or bool(member.privileges.can_delete_messages)
+            else:
+                is_admin = False
+
+        logger.info("admin status: %s (%s)", is_admin, member.status if member is not None else "no member")
+        self.admin_cache[chat_id] = (time.monotonic() + ADMIN_CACHE_TTL, is_admin)
+        return is_admin
+
+    async def _require_admin(self, app: Client, message: Message) -> bool:
+        if await self._is_admin(app, message.chat):  # type: ignore
             return True
+
+        await message.edit_text("__you are not an admin!__")
         return False
 
+    async def _admin_revoked(self, message: Message) -> None:
+        # the cached status was stale
+        self.admin_cache.pop(message.chat.id, None)  # type: ignore
+        await message.edit_text("__you are not an admin!__")
+
+    async def on_member_updated(self, app: Client, update: ChatMemberUpdated) -> None:
+        member = update.new_chat_member or update.old_chat_member
+        chat_id: int | None = update.chat.id if update.chat is not None else None
+        if chat_id is None or member is None or member.user is None or not member.user.is_self:
+            return
+
+        logger.info("our membership in %s changed, dropping cached admin status", chat_id)
+        self.admin_cache.pop(chat_id, None)
+
     async def purge(self, app: Client, message: Message) -> None:
         if not message.reply_to_message:
             await message.edit_text("__reply to a message!__")
             return
 
-        logger.info("purging messages")
+        # without admin rights only our own messages get deleted, which is still useful
+        is_admin = await self._is_admin(app, message.chat)  # type: ignore
 
-        # delete 100-by-100
-        for i in range(message.reply_to_message.id, message.id, 100):
-            chat_id = message.chat.id  # type: ignore
-            message_ids = list(range(i, min(i + 100, message.id)))
+        message_ids = list(range(message.reply_to_message.id, message.id))
+        logger.info("purging %s messages", len(message_ids))
 
-            logger.info("deleting messages: %s", message_ids)
-            await app.delete_messages(
-                chat_id,  # type: ignore
-                message_ids,
-            )
+        last_update: float = time.monotonic()
 
-        confirmation_text: str = "__purged! this message will auto delete in 5 seconds__"
+        async def report(processed: int, total: int) -> None:
+            nonlocal last_update
+            if processed >= total or time.monotonic() - last_update < PURGE_PROGRESS_INTERVAL:
+                return
 
-        if not await self._is_admin(app, message.chat.id):  # type: ignore
+            last_update = time.monotonic()
+            try:
+                await message.edit_text(f"__purging... {processed}/{total}__")
+            except RPCError as e:
+                logger.debug("could not edit purge progress: %s", e)
+
+        start_time = time.perf_counter()
+        deleted = await delete_messages_bulk(app, message.chat.id, message_ids, on_progress=report)  # type: ignore
+        logger.info("purged %s/%s messages in %.3fs", deleted, len(message_ids), time.perf_counter() - start_time)
+
+        confirmation_text: str = f"__purged {deleted} messages! this message will auto delete in 5 seconds__"
+
+        if not is_admin:
             logger.info("user was NOT admin, only their messages are deleted")
             confirmation_text += "\n__warning: you are not an admin, only your messages are purged__"
 
@@ -62,8 +161,7 @@ class ModPlugin(BasePlugin):
 
     # TODO: check if this is PM and forbid this command from running
     async def kick(self, app: Client, message: Message) -> None:
-        if not self._is_admin(app, message.chat.id):  # type: ignore
-            await message.edit_text("__you are not an admin!__")
+        if not await self._require_admin(app, message):
             return
 
         # TODO: allow passing the user's id
@@ -87,7 +185,11 @@ class ModPlugin(BasePlugin):
             target_user_id,
             target_full_name,
         )
-        await self.app.ban_chat_member(target_chat_id, target_user_id)
+        try:
+            await self.app.ban_chat_member(target_chat_id, target_user_id)
+        except ChatAdminRequired:
+            await self._admin_revoked(message)
+            return
 
         logger.info(
             "unban chat_id: %s, user_id: %s, username: %s",
@@ -104,7 +206,14 @@ class ModPlugin(BasePlugin):
             await message.edit_text("__reply to a user message!__")
             return
 
-        await app.ban_chat_member(message.chat.id, message.reply_to_message.from_user.id)  # type: ignore
+        if not await self._require_admin(app, message):
+            return
+
+        try:
+            await app.ban_chat_member(message.chat.id, message.reply_to_message.from_user.id)  # type: ignore
+        except ChatAdminRequired:
+            await self._admin_revoked(message)
+            return
         await message.edit_text("__banned__")
         await asyncio.sleep(5)
         await message.delete()
@@ -114,15 +223,29 @@ class ModPlugin(BasePlugin):
             await message.edit_text("__reply to a user message!__")
             return
 
-        await app.unban_chat_member(message.chat.id, message.reply_to_message.from_user.id)  # type: ignore
+        if not await self._require_admin(app, message):
+            return
+
+        try:
+            await app.unban_chat_member(message.chat.id, message.reply_to_message.from_user.id)  # type: ignore
+        except ChatAdminRequired:
+            await self._admin_revoked(message)
+            return
         await message.edit_text("__unbanned__")
         await asyncio.sleep(5)
         await message.delete()
 
     def register_handlers(self) -> list[Handler]:
-        base = filters.me
         return [
-            MessageHandler(self.purge, filters.command("purge", prefixes=self.prefixes) & base),
-            MessageHandler(self.ban, filters.command("ban", prefixes=self.prefixes) & base),
-            MessageHandler(self.unban, filters.command("unban", prefixes=self.prefixes) & base),
+            CommandHandler(
+                self.purge,
+                "purge",
+                description="delete every message from the replied one on",
+                limit=2,
+                lane=Lane.BULK,
+            ),
+            CommandHandler(self.kick, "kick", description="kick the author of the replied message"),
+            CommandHandler(self.ban, "ban", description="ban the author of the replied message"),
+            CommandHandler(self.unban, "unban", description="unban the author of the replied message"),
+            ChatMemberUpdatedHandler(self.on_member_updated),
         ]
@@ -1,12 +1,11 @@
 import logging
 
-from pyrogram import filters
 from pyrogram.client import Client
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
 from pyrogram.types.messages_and_media import Message
 
 from hbot.base_plugin import BasePlugin
+from hbot.router import CommandHandler
 
 logger = logging.getLogger(__name__)
 
@@ -24,8 +23,5 @@ class PingPlugin(BasePlugin):
 
     def register_handlers(self) -> list[Handler]:
         return [
-            MessageHandler(
-                self.ping,
-                filters.command("ping", prefixes=self.prefixes) & filters.me,
-            ),
+            CommandHandler(self.ping, "ping", description="check that the bot is alive"),
         ]
@@ -1,25 +1,33 @@
+import asyncio
 import json
 import logging
+import time
+from calendar import monthrange
 from dataclasses import dataclass, fields, is_dataclass
+from datetime import datetime, timedelta, timezone
 from itertools import chain, islice, repeat
 from textwrap import dedent
 from typing import Any
 
 from anyio import NamedTemporaryFile
-from httpx import AsyncClient
-from jsondb.database import JsonDB
-from pyrogram import filters
+from httpx import Response
 from pyrogram.client import Client
 from pyrogram.enums import ParseMode
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
 from pyrogram.types.messages_and_media import Message
 
-from hbot import PERSIST_DIR
 from hbot.base_plugin import BasePlugin
+from hbot.router import CommandHandler, Lane
+from hbot.storage import Namespace, storage
+from hbot.tracing import span
 
 logger = logging.getLogger(__name__)
-db: JsonDB = JsonDB(__name__, PERSIST_DIR)
+
+API_HOST: str = "api.waktusolat.app"
+API_URL: str = f"https://{API_HOST}"
+MALAYSIA_TZ: timezone = timezone(timedelta(hours=8))
+PRAYER_CACHE_TTL: int = 7 * 24 * 60 * 60  # seconds
+PREFETCH_CONCURRENCY: int = 8
 
 
 @dataclass(slots=True)
@@ -73,30 +81,94 @@ class SolatPlugin(BasePlugin):
 
     def __init__(self, app: Client) -> None:
         self.app: Client = app
-        self.http_client: AsyncClient = AsyncClient()
+        self.http.set_host_timeout(API_HOST, 10)
+
+        self.zones: dict[str, ZoneData] = {}
+        # on_start and the first command may both find the zones missing, only fetch them once
+        self._zones_lock: asyncio.Lock = asyncio.Lock()
+        self._set_zones(self.store.get("zones", []))
 
-        db.read_database()
-        self.zones_data: list[ZoneData] = [ZoneData(**z) for z in db.data.get("zones", [])]
-        self.valid_jakimcode: list[str] = self._get_valid_jakimcode()
+        # one key per (zone, date), so the sqlite backend only writes the entries that changed
+        self.prayer_cache: Namespace = storage.namespace(f"{self.store.name}.prayer_times")
+        self._prune_prayer_cache()
 
     def _pad_list(self, iterable, size, padding=None) -> Any:
         return islice(chain(iterable, repeat(padding)), size)
 
-    def _get_valid_jakimcode(self) -> list[str]:
-        if len(self.zones_data) == 0:
-            logger.warning("cannot get valid jakimcode: `len(self.zones_data)` is 0")
-            return []
+    def _set_zones(self, zones_json: list[dict[str, str]]) -> None:
+        self.zones = {z["jakimCode"]: ZoneData(**z) for z in zones_json}
+        if len(self.zones) == 0:
+            logger.info("no zones cached yet, they will be fetched in the background")
 
-        return [x.jakimCode for x in self.zones_data]
+    async def _ensure_zones(self) -> None:
+        if len(self.zones) != 0:
+            return
+
+        async with self._zones_lock:
+            if len(self.zones) != 0:
+                return
 
-    async def waktu_solat(self, app: Client, message: Message) -> None:
-        if len(self.zones_data) == 0:
             logger.info("zones are not yet cached. building cache...")
-            response_json = (await self.http_client.get("https://api.waktusolat.app/zones", timeout=10)).json()
-            db.data["zones"] = response_json
-            self.zones_data = [ZoneData(**z) for z in response_json]
-            self.valid_jakimcode = self._get_valid_jakimcode()
-            db.write_database()
+            with span("api_call", endpoint="zones"):
+                response_json = (await self.http.get(f"{API_URL}/zones")).json()
+            self.store["zones"] = response_json
+            self._set_zones(response_json)
+
+    async def on_start(self) -> None:
+        # the zones are needed by every command, fetch them before the first one comes in
+        await self._ensure_zones()
+
+    def _prune_prayer_cache(self) -> None:
+        now = time.time()
+        expired = [k for k, v in self.prayer_cache.items() if v["expires"] <= now]
+        for key in expired:
+            del self.prayer_cache[key]
+
+        if expired:
+            logger.info("pruned %s expired prayer time entries", len(expired))
+
+    @staticmethod
+    def _cache_key(zone: str, day: int, month: int, year: int) -> str:
+        return f"{zone}:{year:04d}-{month:02d}-{day:02d}"
+
+    async def _get_prayer_data(self, zone: str, day: int, month: int, year: int) -> PrayerData | Response:
+        """Return the prayer data from the cache, or fetch it. The raw response is returned if the API call failed."""
+        key = self._cache_key(zone, day, month, year)
+        cached = self.prayer_cache.get(key)
+        if cached is not None and cached["expires"] > time.time():
+            logger.debug("prayer time cache hit: %s", key)
+            return dict_to_dataclass(PrayerData, cached["data"])
+
+        logger.info("prayer time cache miss: %s", key)
+        with span("api_call", endpoint="solat"):
+            response = await self.http.get(
+                f"{API_URL}/solat/{zone}/{day}",
+                params={"month": month, "year": year},
+            )
+        if not response.is_success:
+            return response
+
+        response_json = response.json()
+        prayer_data: PrayerData = dict_to_dataclass(PrayerData, response_json)
+        self.prayer_cache[key] = {"expires": time.time() + PRAYER_CACHE_TTL, "data": response_json}
+        return prayer_data
+
+    def _parse_date_args(self, day: str | None, month: str | None, year: str | None) -> tuple[int, int, int] | None:
+        today = datetime.now(MALAYSIA_TZ)
+        try:
+            parsed_day = int(day) if day else today.day
+            parsed_month = int(month) if month else today.month
+            parsed_year = int(year) if year else today.year
+        except ValueError:
+            return None
+
+        if not 1 <= parsed_month <= 12 or not 1 <= parsed_day <= monthrange(parsed_year, parsed_month)[1]:
+            return None
+
+        return parsed_day, parsed_month, parsed_year
+
+    async def waktu_solat(self, app: Client, message: Message) -> None:
+        await self._ensure_zones()
 
         splitmsg: list[str] = message.text.split(" ")  # type: ignore
         if len(splitmsg) < 3:
@@ -107,35 +179,33 @@ class SolatPlugin(BasePlugin):
         await message.edit_text("__loading...__")
 
         zone, day, month, year = args
+        zone = zone.upper()
 
-        if zone not in self.valid_jakimcode:
+        zone_data: ZoneData | None = self.zones.get(zone)
+        if zone_data is None:
             await message.edit_text(f"invalid zone: {zone}, please refer .getzones")
             return
 
-        extra_data = {}
-        if month:
-            extra_data.update({"month": month})
-        if year:
-            extra_data.update({"year": year})
-        response = await self.http_client.get(
-            f"https://api.waktusolat.app/solat/{zone}/{day}",
-            params=extra_data,
-        )
+        date = self._parse_date_args(day, month, year)
+        if date is None:
+            await message.edit_text("__invalid date, day, month and year must be numbers__")
+            return
 
-        if not response.is_success:
+        result = await self._get_prayer_data(zone, *date)
+        if isinstance(result, Response):
             await message.edit_text(
-                f"__api call failed, status code {response.status_code}\n{response.json()}__",
+                f"__api call failed, status code {result.status_code}\n{result.json()}__",
                 parse_mode=ParseMode.MARKDOWN,
             )
             return
 
-        prayer_data: PrayerData = dict_to_dataclass(PrayerData, response.json())
+        prayer_data: PrayerData = result
         final_output_str: str = dedent(
             f"""
             **query result:**
             **Zone:** {zone}
-            **Negeri:** {[x.negeri for x in self.zones_data if x.jakimCode == zone][0]}
-            **Daerah:** {[x.daerah for x in self.zones_data if x.jakimCode == zone][0]}
+            **Negeri:** {zone_data.negeri}
+            **Daerah:** {zone_data.daerah}
             """
         )
 
@@ -161,29 +231,62 @@ class SolatPlugin(BasePlugin):
 
         await message.edit_text(final_output_str)
 
+    async def prefetch_month(self, app: Client, message: Message) -> None:
+        await self._ensure_zones()
+
+        splitmsg: list[str] = message.text.split(" ")  # type: ignore
+        if len(splitmsg) < 2:
+            await message.edit_text("__syntax: .wsprefetch <zone> [month] [year]__", parse_mode=ParseMode.MARKDOWN)
+            return
+
+        zone, month, year = self._pad_list(splitmsg[1:], 3, None)
+        zone = zone.upper()
+
+        if zone not in self.zones:
+            await message.edit_text(f"invalid zone: {zone}, please refer .getzones")
+            return
+
+        date = self._parse_date_args("1", month, year)
+        if date is None:
+            await message.edit_text("__invalid date, month and year must be numbers__")
+            return
+
+        _, month_num, year_num = date
+        await message.edit_text(f"__prefetching {zone} for {month_num:02d}/{year_num}...__")
+
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+        async def fetch(day: int) -> bool:
+            async with semaphore:
+                return not isinstance(await self._get_prayer_data(zone, day, month_num, year_num), Response)
+
+        results = await asyncio.gather(*(fetch(d) for d in range(1, monthrange(year_num, month_num)[1] + 1)))
+        await message.edit_text(f"__cached {sum(results)}/{len(results)} days for {zone}, {month_num:02d}/{year_num}__")
+
     async def get_zones(self, app: Client, message: Message) -> None:
-        if len(self.zones_data) == 0:
-            logger.info("zones are not yet cached. building cache...")
-            response_json = (await self.http_client.get("https://api.waktusolat.app/zones", timeout=10)).json()
-            db.data["zones"] = response_json
-            self.zones_data = [ZoneData(**z) for z in response_json]
-            self.valid_jakimcode = self._get_valid_jakimcode()
-            db.write_database()
+        await self._ensure_zones()
 
         async with NamedTemporaryFile("w+", suffix=".json") as f:
-            await f.write(json.dumps(db.data.get("zones"), indent=2))
+            await f.write(json.dumps(self.store.get("zones"), indent=2))
             await f.flush()
             await message.reply_document(f.wrapped.name)
             await message.delete()
 
     def register_handlers(self) -> list[Handler]:
         return [
-            MessageHandler(
+            CommandHandler(
                 self.waktu_solat,
-                filters.command(["waktusolat", "waktu_solat", "ws"], prefixes=self.prefixes) & filters.me,
+                ["waktusolat", "waktu_solat", "ws"],
+                usage="<zone> <day> [month] [year]",
+                description="prayer times of a zone",
             ),
-            MessageHandler(
-                self.get_zones,
-                filters.command("getzones", prefixes=self.prefixes) & filters.me,
+            CommandHandler(
+                self.prefetch_month,
+                ["wsprefetch", "waktusolat_prefetch"],
+                usage="<zone> [month] [year]",
+                description="cache the prayer times of a whole month",
+                limit=1,
+                lane=Lane.BULK,
             ),
+            CommandHandler(self.get_zones, "getzones", description="list the zone codes"),
         ]
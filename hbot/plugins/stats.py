@@ -0,0 +1,70 @@
+import html
+import logging
+import time
+
+from pyrogram.client import Client
+from pyrogram.enums import ParseMode
+from pyrogram.handlers.handler import Handler
+from pyrogram.types.messages_and_media import Message
+
+from hbot.base_plugin import BasePlugin
+from hbot.metrics import HandlerMetrics, metrics
+from hbot.router import CommandHandler
+
+logger = logging.getLogger(__name__)
+
+MAX_ROWS: int = 25
+
+
+class StatsPlugin(BasePlugin):
+    name: str = "Stats Plugin"
+    description: str = "Call counts, errors and latency of every command."
+
+    def __init__(self, app: Client) -> None:
+        self.app: Client = app
+
+    @staticmethod
+    def _row(m: HandlerMetrics) -> str:
+        avg = m.latency.total / m.calls if m.calls else 0.0
+        return (
+            f"{m.handler[:16]:<16} {m.calls:>6} {m.errors:>4} {avg * 1000:>8.1f} "
+            f"{m.latency.quantile(0.5) * 1000:>8.1f} {m.latency.quantile(0.95) * 1000:>8.1f}"
+        )
+
+    async def stats(self, app: Client, message: Message) -> None:
+        args: list[str] = message.text.split()[1:]  # type: ignore
+        if args == ["reset"]:
+            metrics.reset()
+            await message.edit_text("__stats reset__")
+            return
+
+        used = [m for m in metrics.handlers.values() if m.calls]
+        if not used:
+            await message.edit_text("__no commands were used yet__")
+            return
+
+        # the handlers that took the most time in total first, they dominate the load
+        used.sort(key=lambda m: m.latency.total, reverse=True)
+        uptime = time.time() - metrics.started
+
+        lines = [f"{'command':<16} {'calls':>6} {'err':>4} {'avg ms':>8} {'p50 ms':>8} {'p95 ms':>8}"]
+        lines += [self._row(m) for m in used[:MAX_ROWS]]
+
+        plugins: dict[str, float] = {}
+        for m in used:
+            plugins[m.plugin] = plugins.get(m.plugin, 0.0) + m.latency.total
+        lines.append("")
+        lines += [f"{name[:30]:<30} {total:>9.2f}s" for name, total in sorted(plugins.items(), key=lambda x: -x[1])]
+
+        await message.edit_text(
+            f"<b>stats for the last {uptime / 3600:.1f}h</b> (<code>.stats reset</code> to clear)\n"
+            f"<pre>{html.escape(chr(10).join(lines))}</pre>",
+            parse_mode=ParseMode.HTML,
+        )
+
+    def register_handlers(self) -> list[Handler]:
+        return [
+            CommandHandler(
+                self.stats, "stats", usage="[reset]", description="call counts, errors and latency of every command"
+            ),
+        ]
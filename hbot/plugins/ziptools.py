@@ -1,21 +1,133 @@
 import logging
+import os
+import pathlib
+import shutil
+import tempfile
 import time
-from asyncio import AbstractEventLoop, get_running_loop
-from typing import cast
-from zipfile import ZipFile, is_zipfile
+import zlib
+from asyncio import (
+    AbstractEventLoop,
+    Queue,
+    QueueEmpty,
+    Semaphore,
+    Task,
+    as_completed,
+    current_task,
+    gather,
+    get_running_loop,
+)
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from typing import IO, cast
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo, is_zipfile
 
-from anyio import NamedTemporaryFile, Path, TemporaryDirectory
-from pyrogram import filters
+from anyio import NamedTemporaryFile, TemporaryDirectory
 from pyrogram.client import Client
 from pyrogram.handlers.handler import Handler
-from pyrogram.handlers.message_handler import MessageHandler
-from pyrogram.types import Document
+from pyrogram.types import Document, InputMediaDocument
 from pyrogram.types.messages_and_media import Message
 
 from hbot.base_plugin import BasePlugin
+from hbot.router import CommandHandler, Lane
+from hbot.tracing import span
 
 logger = logging.getLogger(__name__)
 
+# refuse archives that would expand to more than this
+MAX_UNCOMPRESSED_SIZE: int = 4 * 1024 * 1024 * 1024
+COPY_CHUNK_SIZE: int = 1024 * 1024
+
+# Telegram allows at most 10 documents per media group
+MEDIA_GROUP_SIZE: int = 10
+DEFAULT_UPLOAD_CONCURRENCY: int = 3
+MAX_UPLOAD_CONCURRENCY: int = 8
+
+DEFAULT_COMPRESSION_LEVEL: int = 6
+MAX_ZIP_MESSAGES: int = 1000
+GET_MESSAGES_CHUNK_SIZE: int = 200
+
+
+class UnsafeArchiveError(Exception):
+    pass
+
+
+def _member_path(info: ZipInfo) -> PurePosixPath:
+    return PurePosixPath(info.filename.replace("\\", "/"))
+
+
+def check_members(zipfile: ZipFile) -> list[ZipInfo]:
+    """Return the file members of `zipfile`, refusing path traversal and archives that expand too much."""
+    members: list[ZipInfo] = []
+    total_size: int = 0
+
+    for info in zipfile.infolist():
+        path = _member_path(info)
+        if path.is_absolute() or ".." in path.parts or (path.parts and ":" in path.parts[0]):
+            raise UnsafeArchiveError(f"unsafe path in archive: {info.filename}")
+
+        if info.is_dir():
+            continue
+
+        # the declared size is enforced while reading, ZipExtFile never returns more than `file_size` bytes
+        total_size += info.file_size
+        if total_size > MAX_UNCOMPRESSED_SIZE:
+            raise UnsafeArchiveError(f"archive expands to more than {MAX_UNCOMPRESSED_SIZE} bytes")
+
+        members.append(info)
+
+    return members
+
+
+def extract_member(zipfile: ZipFile, info: ZipInfo, dest: pathlib.Path) -> pathlib.Path:
+    target = dest.joinpath(*_member_path(info).parts)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    with zipfile.open(info) as src, open(target, "wb") as dst:
+        while chunk := src.read(COPY_CHUNK_SIZE):
+            dst.write(chunk)
+
+    return target
+
+
+def compress_file(src: pathlib.Path, dst: IO[bytes], level: int) -> tuple[int, int, int]:
+    """Compress `src` into `dst` as a raw deflate stream (or a plain copy for level 0).
+
+    Returns the CRC-32, the uncompressed size and the compressed size. zlib releases the GIL while compressing,
+    so several of these can run in parallel in a thread pool.
+    """
+    crc: int = 0
+    size: int = 0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if level > 0 else None
+
+    with open(src, "rb") as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            dst.write(compressor.compress(chunk) if compressor else chunk)
+
+    if compressor:
+        dst.write(compressor.flush())
+
+    return crc, size, dst.tell()
+
+
+def write_compressed_member(zipfile: ZipFile, zinfo: ZipInfo, src: IO[bytes]) -> None:
+    """Append a member whose data was already compressed by `compress_file`.
+
+    zipfile can only compress members itself, one at a time, so this writes the local header and data directly
+    and registers the member the same way `ZipFile.write` does, for `close()` to write the central directory.
+    """
+    assert zipfile.fp is not None
+
+    zinfo.header_offset = zipfile.fp.tell()
+    zipfile.fp.write(zinfo.FileHeader())
+    src.seek(0)
+    shutil.copyfileobj(src, zipfile.fp, COPY_CHUNK_SIZE)
+
+    zipfile.filelist.append(zinfo)
+    zipfile.NameToInfo[zinfo.filename] = zinfo
+    zipfile.start_dir = zipfile.fp.tell()
+
 
 class MyPlugin(BasePlugin):
     name: str = "Zip Tools"
@@ -24,8 +136,43 @@ class MyPlugin(BasePlugin):
     def __init__(self, app: Client) -> None:
         self.app: Client = app
 
-    async def progress_logger(self, current: int, total: int):
-        logger.info("zip download progress: %s/%s (%s)", current, total, (current / total) * 100)
+    async def _extract_to_queue(
+        self,
+        zipfile: ZipFile,
+        members: list[ZipInfo],
+        dest: pathlib.Path,
+        queue: Queue[pathlib.Path | Exception | None],
+    ) -> None:
+        loop: AbstractEventLoop = get_running_loop()
+        error: Exception | None = None
+        try:
+            for info in members:
+                logger.info("extracting '%s'", info.filename)
+                with span("extract", member=info.filename):
+                    path = await loop.run_in_executor(None, extract_member, zipfile, info, dest)
+                await queue.put(path)
+        except Exception as e:  # noqa: BLE001
+            # anything the decompressors raise (LZMAError, EOFError on a truncated member...) goes to the consumer
+            error = e
+        finally:
+            # the consumer waits for None or the error, unless it is the one that cancelled us
+            task = current_task()
+            if task is None or not task.cancelling():
+                await queue.put(error)
+
+    async def _upload_batch(self, app: Client, message: Message, batch: list[pathlib.Path]) -> None:
+        logger.info("uploading %s", [x.as_posix() for x in batch])
+
+        with span("upload", files=len(batch)):
+            if len(batch) == 1:
+                progress = self.progress(f"upload {batch[0].name}")
+                await message.reply_document(batch[0].as_posix(), progress=progress)
+            else:
+                media = [InputMediaDocument(x.as_posix()) for x in batch]
+                await app.send_media_group(message.chat.id, media, reply_to_message_id=message.id)  # type: ignore
+
+        for file in batch:
+            file.unlink()
 
     async def unzip(self, app: Client, message: Message) -> None:
         if not message.reply_to_message:
@@ -38,12 +185,23 @@ class MyPlugin(BasePlugin):
             await message.edit_text("__please reply to a zip file__")
             return
 
+        args: list[str] = message.text.split()  # type: ignore
+        concurrency: int = DEFAULT_UPLOAD_CONCURRENCY
+        if len(args) > 1:
+            if not args[1].isdigit() or not 1 <= int(args[1]) <= MAX_UPLOAD_CONCURRENCY:
+                await message.edit_text(f"__syntax: .unzip [concurrent uploads, 1-{MAX_UPLOAD_CONCURRENCY}]__")
+                return
+            concurrency = int(args[1])
+
         loop: AbstractEventLoop = get_running_loop()
         document: Document = cast(Document, replied_to_message.document)
 
         async with NamedTemporaryFile("w+b", suffix=".zip") as f, TemporaryDirectory() as d:
             logger.info("downloading zip to temp file, name = '%s'", f.wrapped.name)
-            await app.download_media(document, f.wrapped.name, progress=self.progress_logger)
+            progress = self.progress("zip download", message)
+            with span("download"):
+                await app.download_media(document, f.wrapped.name, progress=progress)
+            await progress.finish()
 
             logger.info("checking zip file validity")
             if not await loop.run_in_executor(None, is_zipfile, f.wrapped.name):
@@ -54,32 +212,220 @@ class MyPlugin(BasePlugin):
             await message.edit_text("__unzipping__")
 
             zipfile: ZipFile = ZipFile(f.wrapped.name)
-            namelist: list[Path] = [Path(d).joinpath(x) for x in zipfile.namelist()]
+            try:
+                members: list[ZipInfo] = check_members(zipfile)
+            except UnsafeArchiveError as e:
+                logger.warning("refusing to unzip: %s", e)
+                await message.edit_text(f"__refusing to unzip: {e}__")
+                return
 
-            logger.info("zip file name list (with temp dir): %s", namelist)
+            logger.info("zip file members: %s", [x.filename for x in members])
             logger.info("extracting zip file, dir = '%s'", d)
 
+            # extract one member at a time while earlier ones are being uploaded. Up to `concurrency` uploads run
+            # at once, each sending whatever has been extracted in the meantime (up to a media group) in one call.
+            # Only a bounded number of members are ever on disk, and the first upload starts right away.
             start_time = time.perf_counter()
-            await loop.run_in_executor(None, zipfile.extractall, d)
-            duration_unzip = time.perf_counter() - start_time
-            logger.info("unzip took %s seconds", duration_unzip)
+            queue: Queue[pathlib.Path | Exception | None] = Queue(maxsize=MEDIA_GROUP_SIZE)
+            extractor = loop.create_task(self._extract_to_queue(zipfile, members, pathlib.Path(d), queue))
+            slots: Semaphore = Semaphore(concurrency)
+            uploads: list[Task] = []
+            last: pathlib.Path | Exception | None = None
+
+            try:
+                while True:
+                    await slots.acquire()
+                    if (last := await queue.get()) is None or isinstance(last, Exception):
+                        break
+
+                    batch: list[pathlib.Path] = [last]
+                    while len(batch) < MEDIA_GROUP_SIZE:
+                        try:
+                            last = queue.get_nowait()
+                        except QueueEmpty:
+                            break
+                        if last is None or isinstance(last, Exception):
+                            break
+                        batch.append(last)
 
-            for file in namelist:
-                if await file.is_dir():
-                    logger.info("skip uploading '%s' because it is a folder", file.as_posix())
-                    continue
+                    upload = loop.create_task(self._upload_batch(app, message, batch))
+                    upload.add_done_callback(lambda _: slots.release())
+                    uploads.append(upload)
 
-                logger.info("uploading '%s'", file.as_posix())
-                await message.reply_document(file.as_posix())
+                    if last is None or isinstance(last, Exception):
+                        break
+
+                await gather(*uploads)
+            finally:
+                extractor.cancel()
+                for upload in uploads:
+                    upload.cancel()
+                zipfile.close()
+
+            if isinstance(last, Exception):
+                logger.error("failed to extract zip file: %s", last)
+                await message.edit_text(f"__failed to extract zip file: {last}__")
+                return
 
             duration_unzip_and_upload = time.perf_counter() - start_time
             logger.info("unzip + upload took %s seconds", duration_unzip_and_upload)
             await message.edit_text(f"__unzip finished, took {duration_unzip_and_upload:.3f}s__")
 
+    async def _collect_documents(self, app: Client, message: Message, whole_range: bool) -> list[Message]:
+        replied: Message = cast(Message, message.reply_to_message)
+
+        if whole_range:
+            ids = list(range(replied.id, message.id))[:MAX_ZIP_MESSAGES]
+            messages: list[Message] = []
+            for i in range(0, len(ids), GET_MESSAGES_CHUNK_SIZE):
+                chunk = ids[i : i + GET_MESSAGES_CHUNK_SIZE]
+                messages.extend(await app.get_messages(message.chat.id, chunk))  # type: ignore
+        elif replied.media_group_id:
+            messages = await app.get_media_group(message.chat.id, replied.id)  # type: ignore
+        else:
+            messages = [replied]
+
+        return [m for m in messages if m and not m.empty and m.document]
+
+    async def _prepare_member(
+        self,
+        app: Client,
+        doc_message: Message,
+        arcname: str,
+        level: int,
+        workdir: pathlib.Path,
+        pool: ThreadPoolExecutor,
+        slots: Semaphore,
+    ) -> tuple[ZipInfo, IO[bytes]]:
+        loop: AbstractEventLoop = get_running_loop()
+
+        async with slots:
+            download_path = workdir.joinpath(f"{doc_message.id}.part")
+            logger.info("downloading '%s'", arcname)
+            with span("download", member=arcname):
+                await app.download_media(
+                    doc_message, download_path.as_posix(), progress=self.progress(f"download {arcname}")
+                )
+
+            compressed: IO[bytes] = tempfile.TemporaryFile(dir=workdir)
+            try:
+                with span("compress", member=arcname):
+                    crc, size, compressed_size = await loop.run_in_executor(
+                        pool, compress_file, download_path, compressed, level
+                    )
+            except BaseException:
+                compressed.close()
+                raise
+            finally:
+                download_path.unlink(missing_ok=True)
+
+        zinfo = ZipInfo(arcname, date_time=time.localtime()[:6])
+        zinfo.compress_type = ZIP_DEFLATED if level > 0 else ZIP_STORED
+        zinfo.external_attr = 0o644 << 16
+        zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, size, compressed_size
+        return zinfo, compressed
+
+    async def zip_documents(self, app: Client, message: Message) -> None:
+        syntax = "__syntax: .zip [-l 0-9] [-r] [name.zip], reply to a document (-r: up to this message)__"
+        if not message.reply_to_message:
+            await message.edit_text(syntax)
+            return
+
+        args: list[str] = message.text.split()[1:]  # type: ignore
+        level: int = DEFAULT_COMPRESSION_LEVEL
+        whole_range: bool = False
+        archive_name: str = "archive.zip"
+        while args:
+            arg = args.pop(0)
+            if arg == "-r":
+                whole_range = True
+            elif arg == "-l" and args and args[0].isdigit() and 0 <= int(args[0]) <= 9:
+                level = int(args.pop(0))
+            elif not arg.startswith("-"):
+                archive_name = arg if arg.endswith(".zip") else f"{arg}.zip"
+            else:
+                await message.edit_text(syntax)
+                return
+
+        await message.edit_text("__collecting documents__")
+        documents: list[Message] = await self._collect_documents(app, message, whole_range)
+        if not documents:
+            await message.edit_text("__no documents found__")
+            return
+
+        # unique names inside the archive
+        arcnames: list[str] = []
+        seen: dict[str, int] = {}
+        for doc_message in documents:
+            document: Document = cast(Document, doc_message.document)
+            name = os.path.basename(document.file_name or f"{doc_message.id}_{document.file_unique_id}")
+            if name in seen:
+                seen[name] += 1
+                stem, ext = os.path.splitext(name)
+                name = f"{stem} ({seen[name]}){ext}"
+            else:
+                seen[name] = 0
+            arcnames.append(name)
+
+        await message.edit_text(f"__zipping {len(documents)} documents (level {level})__")
+        start_time = time.perf_counter()
+        loop: AbstractEventLoop = get_running_loop()
+        workers: int = os.cpu_count() or 2
+
+        # every document is downloaded and compressed to a temp file in parallel (bounded by `workers`), then
+        # appended to the archive as soon as it is ready and deleted, so nothing is kept on disk twice for long
+        async with TemporaryDirectory() as d:
+            workdir = pathlib.Path(d)
+            archive_path = workdir.joinpath(archive_name)
+            slots = Semaphore(workers)
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip") as pool:
+                tasks = [
+                    loop.create_task(self._prepare_member(app, m, n, level, workdir, pool, slots))
+                    for m, n in zip(documents, arcnames, strict=True)
+                ]
+
+                try:
+                    with ZipFile(archive_path, "w") as zipfile:
+                        for next_member in as_completed(tasks):
+                            zinfo, compressed = await next_member
+                            with compressed:
+                                await loop.run_in_executor(None, write_compressed_member, zipfile, zinfo, compressed)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    for task in await gather(*tasks, return_exceptions=True):
+                        if isinstance(task, tuple):
+                            task[1].close()
+
+            duration = time.perf_counter() - start_time
+            logger.info("zipping %s documents took %s seconds", len(documents), duration)
+
+            await message.edit_text(f"__uploading {archive_name}__")
+            progress = self.progress(f"upload {archive_name}", message)
+            with span("upload"):
+                await message.reply_document(archive_path.as_posix(), progress=progress)
+            await progress.finish()
+
+        duration_zip_and_upload = time.perf_counter() - start_time
+        await message.edit_text(f"__zip finished, took {duration_zip_and_upload:.3f}s__")
+
     def register_handlers(self) -> list[Handler]:
         return [
-            MessageHandler(
+            CommandHandler(
                 self.unzip,
-                filters.command("unzip", prefixes=self.prefixes) & filters.me,
+                "unzip",
+                usage="[concurrent uploads]",
+                description="extract the replied zip file",
+                limit=2,
+                lane=Lane.BULK,
+            ),
+            CommandHandler(
+                self.zip_documents,
+                "zip",
+                usage="[-l 0-9] [-r] [name.zip]",
+                description="zip the replied document, -r: every document up to this message",
+                limit=2,
+                lane=Lane.BULK,
             ),
         ]
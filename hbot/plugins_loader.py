@@ -1,52 +1,377 @@
+import ast
+import asyncio
 import importlib.util
 import logging
 from collections.abc import Iterable
+from dataclasses import dataclass, field
 from os import PathLike
 from pathlib import Path
+from types import ModuleType
+from typing import Literal
 
 from pyrogram.client import Client
 from pyrogram.handlers.handler import Handler
+from pyrogram.types.messages_and_media import Message
 
 from hbot import PLUGINS_DIR
 from hbot.base_plugin import BasePlugin
+from hbot.help_registry import CommandHelp, help_registry
+from hbot.metrics import metrics
+from hbot.router import CommandHandler, CommandRouter
 
 logger = logging.getLogger(__name__)
+router: CommandRouter = CommandRouter(BasePlugin.prefixes)
 
+# how long shutting down waits for the plugins' `on_stop`
+STOP_TIMEOUT: float = 10.0  # seconds
 
-def load_plugins(app: Client, plugins_dir: PathLike | str = PLUGINS_DIR) -> dict[BasePlugin, list[Handler]]:
+
+@dataclass(slots=True)
+class PluginSpec:
+    """Metadata of a plugin class, read from its source file without executing it."""
+
+    file: Path
+    class_name: str
+    name: str = BasePlugin.name
+    description: str = BasePlugin.description
+    commands: list[str] = field(default_factory=list)
+    help: list[CommandHelp] = field(default_factory=list)
+    lazy_load: bool = True
+
+
+# plugins that were indexed but not imported yet, keyed by file
+pending_plugins: dict[Path, list[PluginSpec]] = {}
+_placeholders: dict[Path, CommandHandler] = {}
+
+# whether `start_plugins` ran, plugins loaded after that (lazily or by a reload) are started right away
+_started: bool = False
+_start_tasks: set[asyncio.Task] = set()
+
+
+def _literal_commands(node: ast.expr) -> list[str] | None:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+
+    if isinstance(node, ast.List | ast.Tuple) and all(
+        isinstance(x, ast.Constant) and isinstance(x.value, str) for x in node.elts
+    ):
+        return [x.value for x in node.elts]  # type: ignore
+
+    return None
+
+
+def _literal_str(node: ast.expr | None) -> str:
+    return node.value if isinstance(node, ast.Constant) and isinstance(node.value, str) else ""
+
+
+def scan_plugin(file: Path) -> list[PluginSpec] | None:
+    """Statically index the plugin classes in `file`.
+
+    Returns None if the file cannot be loaded lazily, i.e. a plugin opted out with `lazy_load = False`,
+    registers something other than a `CommandHandler`, or uses command names that are not literals.
+    """
+    tree: ast.Module = ast.parse(file.read_text(encoding="utf-8"), file.name)
+    specs: list[PluginSpec] = []
+
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        if not any(isinstance(b, ast.Name) and b.id == "BasePlugin" for b in node.bases):
+            continue
+
+        spec = PluginSpec(file, node.name)
+
+        for stmt in node.body:
+            if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name) and stmt.value is not None:
+                target, value = stmt.target.id, stmt.value
+            elif isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                target, value = stmt.targets[0].id, stmt.value
+            else:
+                continue
+
+            if not isinstance(value, ast.Constant):
+                continue
+            if target in ("name", "description") and isinstance(value.value, str):
+                setattr(spec, target, value.value)
+            elif target == "lazy_load" and isinstance(value.value, bool):
+                spec.lazy_load = value.value
+
+        if not spec.lazy_load:
+            return None
+
+        for call in ast.walk(node):
+            if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+                continue
+            if call.func.id == "CommandHandler":
+                commands = _literal_commands(call.args[1]) if len(call.args) > 1 else None
+                if commands is None:
+                    return None
+                commands = [c.lower() for c in commands]
+                spec.commands.extend(commands)
+
+                # usage and description may be given positionally or by keyword, anything but a literal is left out
+                help_args: list[ast.expr | None] = [*call.args[2:4], None, None][:2]
+                for keyword in call.keywords:
+                    if keyword.arg == "usage":
+                        help_args[0] = keyword.value
+                    elif keyword.arg == "description":
+                        help_args[1] = keyword.value
+                spec.help.append(CommandHelp(spec.name, tuple(commands), *map(_literal_str, help_args)))
+            elif call.func.id.endswith("Handler"):
+                # other handler types have to be installed on the client right away
+                return None
+
+        specs.append(spec)
+
+    if not specs or not all(s.commands for s in specs):
+        return None
+
+    return specs
+
+
+def _module_name(file: Path) -> str:
+    return f"dynamically_loaded_plugin_{file.stem}"
+
+
+def _help_key(module_name: str, class_name: str) -> str:
+    return f"{module_name}.{class_name}"
+
+
+def _exec_plugin_module(file: Path) -> ModuleType | None:
+    module_name = _module_name(file)
+    spec = importlib.util.spec_from_file_location(module_name, file)
+
+    if spec is None or spec.loader is None:
+        logger.error("could not load plugin '%s'", file.name)
+        return None
+
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type:plugins ignore
+    return module
+
+
+def _instantiate_plugins(app: Client, module: ModuleType) -> list[tuple[BasePlugin, list[Handler]]]:
+    """Create the plugins of `module` and collect their handlers, without installing anything yet."""
+    plugins: list[tuple[BasePlugin, list[Handler]]] = []
+    for attr_name in dir(module):
+        attr = getattr(module, attr_name)
+        if isinstance(attr, type) and issubclass(attr, BasePlugin) and attr is not BasePlugin:
+            plugin_instance: BasePlugin = attr(app)
+            handlers: list[Handler] = plugin_instance.register_handlers()
+
+            if not isinstance(handlers, list):
+                raise ValueError("method register_handlers MUST return list[Handler]!")
+
+            plugins.append((plugin_instance, handlers))
+    return plugins
+
+
+def _install_plugins(
+    app: Client, plugins: list[tuple[BasePlugin, list[Handler]]], loaded: dict[BasePlugin, list[Handler]]
+) -> None:
+    for plugin_instance, handlers in plugins:
+        plugin_class = type(plugin_instance)
+        for h in handlers:
+            metrics.instrument(h, plugin_class.name)
+            if isinstance(h, CommandHandler):
+                router.add(h)
+            else:
+                app.add_handler(h)
+
+        loaded.update({plugin_instance: handlers})
+        help_registry.set_plugin(
+            _help_key(plugin_class.__module__, plugin_class.__qualname__),
+            plugin_class.name,
+            plugin_class.description,
+            [
+                CommandHelp(plugin_class.name, tuple(h.commands), h.usage, h.description)
+                for h in handlers
+                if isinstance(h, CommandHandler)
+            ],
+        )
+
+        logger.info("loaded plugin '%s'. desc: '%s'", plugin_class.name, plugin_class.description)
+
+
+def _register_plugins(app: Client, module: ModuleType, loaded: dict[BasePlugin, list[Handler]]) -> None:
+    _install_plugins(app, _instantiate_plugins(app, module), loaded)
+
+
+def _defer_plugin(app: Client, file: Path, specs: list[PluginSpec], loaded: dict[BasePlugin, list[Handler]]) -> None:
+    lock: asyncio.Lock = asyncio.Lock()
+
+    async def load_on_first_use(client: Client, message: Message) -> None:
+        async with lock:
+            if file in pending_plugins:
+                logger.info("first use of lazily indexed plugin '%s', importing it", file.name)
+                module = await asyncio.get_running_loop().run_in_executor(None, _exec_plugin_module, file)
+                if module is None:
+                    return
+
+                router.remove(placeholder)
+                before: set[BasePlugin] = set(loaded)
+                _register_plugins(app, module, loaded)
+                del pending_plugins[file]
+                del _placeholders[file]
+                _start_in_background([p for p in loaded if p not in before])
+
+        await router.dispatch(client, message)
+
+    placeholder = CommandHandler(load_on_first_use, [c for s in specs for c in s.commands])
+    router.add(placeholder)
+    pending_plugins[file] = specs
+    _placeholders[file] = placeholder
+
+    for s in specs:
+        help_registry.set_plugin(_help_key(_module_name(file), s.class_name), s.name, s.description, s.help)
+        logger.info("indexed plugin '%s' (commands: %s). desc: '%s'", s.name, s.commands, s.description)
+
+
+def load_plugins(
+    app: Client,
+    plugins_dir: PathLike | str = PLUGINS_DIR,
+    lazy: bool = False,
+) -> dict[BasePlugin, list[Handler]]:
+    """Load every plugin in `plugins_dir`.
+
+    With `lazy`, plugins that can be indexed statically (see `scan_plugin`) are not imported until
+    one of their commands is used. The returned dict is updated in place when that happens.
+    """
     loaded: dict[BasePlugin, list[Handler]] = {}
-    plugins: Iterable[PathLike] = Path(plugins_dir).resolve().glob("*.py")
+    plugins: Iterable[Path] = Path(plugins_dir).resolve().glob("*.py")
+    router.install(app)
 
     for file in plugins:
         if file.name.startswith("_"):
             continue
 
-        logger.info("loading: '%s'", file.name)
+        if lazy:
+            specs: list[PluginSpec] | None = scan_plugin(file)
+            if specs is not None:
+                _defer_plugin(app, file, specs, loaded)
+                continue
 
-        module_name = f"dynamically_loaded_plugin_{file.stem}"
-        spec = importlib.util.spec_from_file_location(module_name, file)
+        logger.info("loading: '%s'", file.name)
 
-        if spec is None or spec.loader is None:
-            logger.error("could not load plugin '%s'", file.name)
+        module = _exec_plugin_module(file)
+        if module is None:
             continue
 
-        module = importlib.util.module_from_spec(spec)  # type: ignore
-        spec.loader.exec_module(module)  # type:plugins ignore
+        _register_plugins(app, module, loaded)
+
+    return loaded
 
-        for attr_name in dir(module):
-            attr = getattr(module, attr_name)
-            if isinstance(attr, type) and issubclass(attr, BasePlugin) and attr is not BasePlugin:
-                plugin_instance: BasePlugin = attr(app)
-                handlers: list[Handler] = plugin_instance.register_handlers()
 
-                if not isinstance(handlers, list):
-                    raise ValueError("method register_handlers MUST return list[Handler]!")
+def _unregister_plugins(app: Client, file: Path, loaded: dict[BasePlugin, list[Handler]]) -> None:
+    module_name = _module_name(file)
+    if file in pending_plugins:
+        router.remove(_placeholders.pop(file))
+        for spec in pending_plugins.pop(file):
+            help_registry.remove_plugin(_help_key(module_name, spec.class_name))
 
-                for h in handlers:
-                    app.add_handler(h)
+    for plugin in [p for p in loaded if type(p).__module__ == module_name]:
+        help_registry.remove_plugin(_help_key(module_name, type(plugin).__qualname__))
+        for h in loaded.pop(plugin):
+            if isinstance(h, CommandHandler):
+                router.remove(h)
+            else:
+                app.remove_handler(h)
 
-                loaded.update({plugin_instance: handlers})
+        logger.info("unloaded plugin '%s'", plugin.name)
 
-                logger.info("loaded plugin '%s'. desc: '%s'", attr.name, attr.description)
 
-    return loaded
+async def reload_plugin(
+    app: Client,
+    loaded: dict[BasePlugin, list[Handler]],
+    plugin: str,
+    plugins_dir: PathLike | str = PLUGINS_DIR,
+) -> list[BasePlugin]:
+    """Re-execute a single plugin module and swap its handlers, without touching the connection.
+
+    `plugin` is the file name of the plugin without the extension, e.g. `ziptools`. `loaded` is updated in place.
+    If the new module fails to execute, or its plugins fail to be created or to return their handlers, the old
+    handlers are left untouched and the exception is propagated.
+    """
+    # a plain name only, anything like "../main" would execute a file outside of the plugins directory
+    if not plugin.isidentifier() or plugin.startswith("_"):
+        raise ValueError(f"invalid plugin name: {plugin!r}")
+
+    file: Path = Path(plugins_dir).resolve().joinpath(f"{plugin}.py")
+    if not file.is_file():
+        raise FileNotFoundError(f"no such plugin: {plugin}")
+
+    logger.info("reloading: '%s'", file.name)
+    module = await asyncio.get_running_loop().run_in_executor(None, _exec_plugin_module, file)
+    if module is None:
+        raise ImportError(f"could not load plugin '{file.name}'")
+
+    # everything that can fail comes before the old plugins are stopped
+    plugins = _instantiate_plugins(app, module)
+
+    module_name = _module_name(file)
+    if _started:
+        await _run_hooks([p for p in loaded if type(p).__module__ == module_name], "on_stop", STOP_TIMEOUT)
+
+    _unregister_plugins(app, file, loaded)
+
+    _install_plugins(app, plugins, loaded)
+
+    reloaded: list[BasePlugin] = [p for p, _ in plugins]
+    _start_in_background(reloaded)
+    return reloaded
+
+
+async def _run_hook(plugin: BasePlugin, hook: Literal["on_start", "on_stop"]) -> None:
+    try:
+        await getattr(plugin, hook)()
+    except Exception:
+        logger.exception("%s of plugin '%s' failed", hook, plugin.name)
+
+
+async def _run_hooks(
+    plugins: Iterable[BasePlugin], hook: Literal["on_start", "on_stop"], timeout: float | None = None
+) -> None:
+    # plugins that don't override the hook are skipped, so the log only shows the ones doing something
+    plugins = [p for p in plugins if getattr(type(p), hook) is not getattr(BasePlugin, hook)]
+    if not plugins:
+        return
+
+    start = asyncio.get_running_loop().time()
+    try:
+        async with asyncio.timeout(timeout):
+            async with asyncio.TaskGroup() as tg:
+                for plugin in plugins:
+                    tg.create_task(_run_hook(plugin, hook), name=f"{hook}:{plugin.name}")
+    except TimeoutError:
+        logger.warning("%s of %s plugin(s) did not finish within %ss", hook, len(plugins), timeout)
+        return
+
+    logger.info("ran %s of %s plugin(s) in %.3fs", hook, len(plugins), asyncio.get_running_loop().time() - start)
+
+
+def _start_in_background(plugins: list[BasePlugin]) -> None:
+    if not _started or not plugins:
+        return
+
+    task = asyncio.get_running_loop().create_task(_run_hooks(plugins, "on_start"))
+    _start_tasks.add(task)
+    task.add_done_callback(_start_tasks.discard)
+
+
+def start_plugins(loaded: dict[BasePlugin, list[Handler]]) -> None:
+    """Run `on_start` of every loaded plugin concurrently in the background. Call it once the client is started."""
+    global _started
+    _started = True
+    _start_in_background(list(loaded))
+
+
+async def stop_plugins(loaded: dict[BasePlugin, list[Handler]], timeout: float = STOP_TIMEOUT) -> None:
+    """Cancel `on_start` hooks that are still running and run `on_stop` of every loaded plugin concurrently."""
+    global _started
+    _started = False
+
+    for task in _start_tasks:
+        task.cancel()
+    await asyncio.gather(*_start_tasks, return_exceptions=True)
+
+    await _run_hooks(list(loaded), "on_stop", timeout)
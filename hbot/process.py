@@ -0,0 +1,147 @@
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO
+
+logger = logging.getLogger(__name__)
+
+# asyncio.create_subprocess_exec is broken with uvloop, so processes are started with subprocess.Popen and their
+# pipes are read from this pool. It is separate from the loop's default executor so a long running command never
+# starves other plugins, and each process needs two of its threads (one reading output, one waiting for the exit).
+MAX_PROCESSES: int = 4
+_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=MAX_PROCESSES * 2, thread_name_prefix="process")
+_slots: asyncio.Semaphore | None = None
+
+READ_SIZE: int = 64 * 1024
+# output beyond this is written to a temp file instead of being kept in memory
+MAX_MEMORY_OUTPUT: int = 256 * 1024
+# characters of output that are kept in memory for display once the output went to a file
+TAIL_SIZE: int = 4096
+KILL_GRACE: float = 5.0  # seconds between SIGTERM and SIGKILL
+
+
+@dataclass(slots=True)
+class ProcessResult:
+    returncode: int | None
+    output: str
+    """The whole output, or only its last `TAIL_SIZE` characters if it was spilled to `output_file`."""
+    output_file: Path | None
+    """Temp file with the whole output if it grew past `MAX_MEMORY_OUTPUT`, the caller must delete it."""
+    timed_out: bool
+    duration: float
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+
+class _Output:
+    def __init__(self) -> None:
+        self.text: str = ""
+        self.size: int = 0
+        self.file: IO[str] | None = None
+
+    def write(self, text: str) -> None:
+        self.size += len(text)
+        if self.file is None and self.size > MAX_MEMORY_OUTPUT:
+            self.file = tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False)
+            self.file.write(self.text)
+
+        if self.file is not None:
+            self.file.write(text)
+            self.text = (self.text + text)[-TAIL_SIZE:]
+        else:
+            self.text += text
+
+    def close(self) -> Path | None:
+        if self.file is None:
+            return None
+        self.file.close()
+        return Path(self.file.name)
+
+
+def _kill(process: subprocess.Popen) -> None:
+    """Terminate the whole process group, so commands started by a shell are stopped too."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+
+        try:
+            process.wait(KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+async def run_process(
+    args: list[str],
+    timeout: float | None = None,
+    on_output: Callable[[str], Awaitable[None]] | None = None,
+    cwd: str | None = None,
+) -> ProcessResult:
+    """Run `args` without blocking the loop, with stderr merged into stdout.
+
+    `on_output` is awaited with every decoded chunk of output as it arrives. The process (and everything it
+    started) is killed if it runs longer than `timeout` seconds, or if the calling task is cancelled.
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_PROCESSES)
+
+    loop = asyncio.get_running_loop()
+    output = _Output()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    timed_out: bool = False
+
+    async with _slots:
+        logger.info("running %s", args)
+        start_time = time.perf_counter()
+        process = subprocess.Popen(  # noqa: S603
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            start_new_session=True,
+        )
+        assert process.stdout is not None
+        fd = process.stdout.fileno()
+
+        try:
+            async with asyncio.timeout(timeout):
+                while chunk := await loop.run_in_executor(_pool, os.read, fd, READ_SIZE):
+                    if text := decoder.decode(chunk):
+                        output.write(text)
+                        if on_output is not None:
+                            await on_output(text)
+
+                if text := decoder.decode(b"", final=True):
+                    output.write(text)
+                await loop.run_in_executor(_pool, process.wait)
+        except TimeoutError:
+            logger.warning("%s timed out after %ss, killing it", args, timeout)
+            timed_out = True
+            await loop.run_in_executor(_pool, _kill, process)
+        except asyncio.CancelledError:
+            logger.warning("%s was cancelled, killing it", args)
+            await asyncio.shield(loop.run_in_executor(_pool, _kill, process))
+            if spilled := output.close():
+                spilled.unlink()
+            raise
+        finally:
+            process.stdout.close()
+
+    duration = time.perf_counter() - start_time
+    logger.info("%s exited with %s after %.3fs", args, process.returncode, duration)
+    return ProcessResult(process.returncode, output.text, output.close(), timed_out, duration)
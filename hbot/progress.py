@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+
+from pyrogram.errors import RPCError
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# a progress line is written at most this often, and only once the transfer moved by at least `LOG_STEP` percent
+LOG_INTERVAL: float = 5.0  # seconds
+LOG_STEP: float = 5.0  # percent
+
+# status message edits are much more expensive than log lines and count towards flood limits
+EDIT_INTERVAL: float = 10.0  # seconds
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressTracker:
+    """Progress callback for pyrogram downloads and uploads, pass it as `progress=`.
+
+    pyrogram calls it for every chunk. Only some of the calls are reported: a log line is written at most every
+    `log_interval` seconds and `log_step` percent, and if `message` is given it is edited with the progress at most
+    every `edit_interval` seconds. Edits run in the background, so a slow or failing edit never stalls the transfer.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        message: Message | None = None,
+        log_interval: float = LOG_INTERVAL,
+        log_step: float = LOG_STEP,
+        edit_interval: float = EDIT_INTERVAL,
+    ) -> None:
+        self.label: str = label
+        self.message: Message | None = message
+        self.log_interval: float = log_interval
+        self.log_step: float = log_step
+        self.edit_interval: float = edit_interval
+
+        self.start_time: float = time.monotonic()
+        self.current: int = 0
+        self.total: int = 0
+        self._last_log: float = self.start_time
+        self._last_log_percent: float = 0.0
+        self._last_edit: float = self.start_time
+        self._edit_task: asyncio.Task | None = None
+
+    @property
+    def percent(self) -> float:
+        return self.current * 100 / self.total if self.total else 0.0
+
+    @property
+    def speed(self) -> float:
+        """Average throughput since the start, in bytes per second."""
+        elapsed = time.monotonic() - self.start_time
+        return self.current / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float | None:
+        speed = self.speed
+        if not self.total or speed <= 0:
+            return None
+        return (self.total - self.current) / speed
+
+    def status(self) -> str:
+        eta = self.eta
+        return (
+            f"{self.label}: {self.percent:.1f}% ({format_size(self.current)}/{format_size(self.total)}) "
+            f"at {format_size(self.speed)}/s, eta {format_duration(eta) if eta is not None else '?'}"
+        )
+
+    async def __call__(self, current: int, total: int) -> None:
+        self.current, self.total = current, total
+        now = time.monotonic()
+        done = total > 0 and current >= total
+
+        if done or (
+            now - self._last_log >= self.log_interval and self.percent - self._last_log_percent >= self.log_step
+        ):
+            self._last_log, self._last_log_percent = now, self.percent
+            logger.info("%s", self.status())
+
+        if self.message is None or done or now - self._last_edit < self.edit_interval:
+            return
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+
+        self._last_edit = now
+        self._edit_task = asyncio.get_running_loop().create_task(self._edit(f"__{self.status()}__"))
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self.message.edit_text(text)  # type: ignore
+        except RPCError as e:
+            logger.debug("could not edit progress message: %s", e)
+
+    async def finish(self) -> None:
+        """Wait for a pending status edit, call this before editing `message` with something else."""
+        if self._edit_task is not None:
+            await self._edit_task
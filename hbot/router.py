@@ -0,0 +1,196 @@
+import asyncio
+import inspect
+import logging
+import re
+from collections.abc import Callable
+from enum import StrEnum
+from typing import cast
+
+from pyrogram.client import Client
+from pyrogram.filters import Filter
+from pyrogram.handlers.handler import Handler
+from pyrogram.handlers.message_handler import MessageHandler
+from pyrogram.types import Update
+from pyrogram.types.messages_and_media import Message
+
+from hbot import BULK_JOBS
+from hbot.tracing import trace
+
+logger = logging.getLogger(__name__)
+
+# the argument splitting of `filters.command`: "quoted text" (or 'quoted text') is one argument
+_ARGUMENT_RE: re.Pattern[str] = re.compile(r"([\"'])(.*?)(?<!\\)\1|(\S+)")
+_ESCAPED_QUOTE_RE: re.Pattern[str] = re.compile(r"\\([\"'])")
+
+
+def split_arguments(text: str) -> list[str]:
+    return [_ESCAPED_QUOTE_RE.sub(r"\1", m[2] or m[3] or "") for m in _ARGUMENT_RE.finditer(text)]
+
+
+class Lane(StrEnum):
+    # awaited by the update worker that received the message, for commands that finish quickly
+    INTERACTIVE = "interactive"
+    # run in a task of their own, so long jobs never hold on to one of pyrogram's (few) update workers
+    BULK = "bulk"
+
+
+class CommandHandler(Handler):
+    """A handler for one or more prefixed commands.
+
+    Unlike a regular :class:`MessageHandler`, this is never added to the client directly. The plugin loader
+    hands it to :class:`CommandRouter`, which looks it up by command name instead of running a filter per handler.
+
+    `usage` (the arguments, e.g. `"<zone> <day> [month]"`) and `description` are shown by `.help`.
+
+    At most `limit` instances of the command run at once, further uses are answered with a "busy" reply right away.
+    Long running commands (downloads, subprocesses, API calls that take seconds) should use `Lane.BULK`.
+    """
+
+    def __init__(
+        self,
+        callback: Callable,
+        commands: str | list[str],
+        usage: str = "",
+        description: str = "",
+        limit: int | None = None,
+        lane: Lane = Lane.INTERACTIVE,
+    ) -> None:
+        super().__init__(callback)
+        self.commands: list[str] = [c.lower() for c in ([commands] if isinstance(commands, str) else commands)]
+        self.usage: str = usage
+        self.description: str = description
+        self.limit: int | None = limit
+        self.lane: Lane = lane
+        self.slots: asyncio.Semaphore | None = asyncio.Semaphore(limit) if limit else None
+
+
+class _RouterFilter(Filter):
+    def __init__(self, router: "CommandRouter") -> None:
+        self.router: CommandRouter = router
+
+    async def __call__(self, client: Client, update: Update) -> bool:
+        # only ever added to a MessageHandler
+        return self.router.parse(cast(Message, update)) is not None
+
+
+class CommandRouter:
+    """Parse the prefix and command token once per message and dispatch through a dict lookup."""
+
+    def __init__(self, prefixes: list[str]) -> None:
+        # longest first, so that e.g. ".." is not shadowed by "."
+        self.prefixes: list[str] = sorted(prefixes, key=len, reverse=True)
+
+        # first character of every prefix, used to reject most messages without any string slicing.
+        # an empty prefix matches everything, so the shortcut is disabled in that case
+        self._prefix_heads: frozenset[str] | None = None if "" in prefixes else frozenset(p[0] for p in prefixes)
+
+        self.commands: dict[str, CommandHandler] = {}
+        self.handler: MessageHandler = MessageHandler(self.dispatch, _RouterFilter(self))
+        self._installed_on: Client | None = None
+
+        # shared by every bulk command, on top of their own limits
+        self.bulk_slots: asyncio.Semaphore = asyncio.Semaphore(BULK_JOBS)
+        self.bulk_tasks: set[asyncio.Task] = set()
+
+    def install(self, app: Client) -> None:
+        if self._installed_on is app:
+            return
+
+        app.add_handler(self.handler)
+        self._installed_on = app
+
+    def add(self, handler: CommandHandler) -> None:
+        for command in handler.commands:
+            if command in self.commands and self.commands[command] is not handler:
+                logger.warning("command '%s' is already registered, overriding it", command)
+
+            self.commands[command] = handler
+
+    def remove(self, handler: CommandHandler) -> None:
+        for command in handler.commands:
+            if self.commands.get(command) is handler:
+                del self.commands[command]
+
+    def parse(self, message: Message) -> CommandHandler | None:
+        text: str | None = message.text or message.caption
+        if not text:
+            return None
+
+        if self._prefix_heads is not None and text[0] not in self._prefix_heads:
+            return None
+
+        if not (message.outgoing or (message.from_user and message.from_user.is_self)):
+            return None
+
+        for prefix in self.prefixes:
+            if text.startswith(prefix):
+                break
+        else:
+            return None
+
+        # like `filters.command`, the command has to follow the prefix directly (". ping" is not a command)
+        parts: list[str] = text[len(prefix) :].split(maxsplit=1)
+        if not parts or text[len(prefix)].isspace():
+            return None
+
+        command: str = parts[0].lower()
+        handler: CommandHandler | None = self.commands.get(command)
+        if handler is None:
+            return None
+
+        # keep `message.command` compatible with what `filters.command` used to provide
+        message.command = [command, *(split_arguments(parts[1]) if len(parts) > 1 else [])]
+        return handler
+
+    async def dispatch(self, client: Client, message: Message) -> None:
+        # `message.command` was set by the filter; the handler could have been removed in between (e.g. reload)
+        handler: CommandHandler | None = self.commands.get(message.command[0])  # type: ignore
+        if handler is None:
+            return
+
+        command: str = message.command[0]  # type: ignore
+        bulk: bool = handler.lane is Lane.BULK
+
+        # answer right away instead of queueing, a command stuck behind a long job looks like the bot hangs.
+        # there is no await between checking and taking the slots, so nothing can take them in between
+        if handler.slots is not None and handler.slots.locked():
+            logger.info("command '%s' is busy, %s running already", command, handler.limit)
+            await message.edit_text(f"__{command} is busy, try again once the running one finished__")
+            return
+        if bulk and self.bulk_slots.locked():
+            logger.info("bulk lane is full, rejecting command '%s'", command)
+            await message.edit_text(f"__{BULK_JOBS} long running commands are running already, try again later__")
+            return
+
+        if handler.slots is not None:
+            await handler.slots.acquire()
+        if bulk:
+            await self.bulk_slots.acquire()
+
+        run = self._run(handler, command, client, message)
+        if not bulk:
+            await run
+            return
+
+        task: asyncio.Task = asyncio.get_running_loop().create_task(run)
+        self.bulk_tasks.add(task)
+        task.add_done_callback(self._bulk_done)
+
+    async def _run(self, handler: CommandHandler, command: str, client: Client, message: Message) -> None:
+        try:
+            with trace(f"command:{command}", command=command, lane=handler.lane.value):
+                if inspect.iscoroutinefunction(handler.callback):
+                    await handler.callback(client, message)
+                else:
+                    await client.loop.run_in_executor(client.executor, handler.callback, client, message)
+        finally:
+            if handler.slots is not None:
+                handler.slots.release()
+            if handler.lane is Lane.BULK:
+                self.bulk_slots.release()
+
+    def _bulk_done(self, task: asyncio.Task) -> None:
+        self.bulk_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # nobody awaits the task, so log the error like pyrogram does for the handlers it awaits
+            logger.error("bulk command failed", exc_info=task.exception())
@@ -0,0 +1,248 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from pyrogram.client import Client
+from pyrogram.errors import FloodWait
+
+from hbot.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second overall and about one per second in the same chat. Short bursts
+# are fine, so the per-chat bucket lets a few calls through at once ("loading..." followed by the result).
+GLOBAL_RATE: float = 25.0  # calls per second
+GLOBAL_BURST: int = 30
+CHAT_RATE: float = 1.0  # calls per second
+CHAT_BURST: int = 3
+# deletions have a budget of their own, a FloodWait while purging must not hold up sends and edits
+DELETE_RATE: float = 20.0  # calls per second
+DELETE_BURST: int = 20
+
+MAX_CHAT_BUCKETS: int = 1000
+
+MAX_FLOOD_RETRIES: int = 5
+MAX_FLOOD_WAIT: float = 600  # seconds
+
+# methods that count towards the per-chat limit as well as the global one
+CHAT_METHODS: tuple[str, ...] = (
+    "send_message",
+    "send_document",
+    "send_photo",
+    "send_media_group",
+    "forward_messages",
+    "copy_message",
+    "edit_message_text",
+    "edit_message_caption",
+    "edit_message_media",
+)
+# deletions are not limited per chat as strictly, they only go through the deletion bucket
+DELETE_METHODS: tuple[str, ...] = ("delete_messages",)
+EDIT_METHODS: frozenset[str] = frozenset({"edit_message_text", "edit_message_caption", "edit_message_media"})
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, and up to `capacity` at once. Waiters are served in order."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate: float = rate
+        self.capacity: int = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.paused_until: float = 0.0
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds`, e.g. after a FloodWait."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self) -> bool:
+        """Whether the bucket is full and nobody is waiting, i.e. it behaves exactly like a new one."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now and not self._lock.locked()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass(slots=True)
+class _PendingEdit:
+    args: tuple[Any, ...]
+    kwargs: dict[str, Any]
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    # callers waiting for the result, the edit is dropped if all of them are cancelled
+    waiters: int = 1
+    task: asyncio.Task | None = None
+
+
+class Scheduler:
+    """Rate limits outgoing API calls of a client with a global and a per-chat token bucket, deletions with a bucket
+    of their own.
+
+    Calls wait for a token instead of running into a FloodWait. If one happens anyway, the bucket it belongs to is
+    paused for the requested time and the call is retried. This is the only place FloodWaits are retried, callers
+    should not retry them again. An edit of a message that is still waiting for its turn replaces the waiting edit,
+    and both callers get the result of the newest one.
+    """
+
+    def __init__(self) -> None:
+        self.global_bucket: TokenBucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.delete_bucket: TokenBucket = TokenBucket(DELETE_RATE, DELETE_BURST)
+        self.chat_buckets: dict[str, TokenBucket] = {}
+        self.pending_edits: dict[tuple[str, int], _PendingEdit] = {}
+        self.collapsed_edits: int = 0
+        self._installed_on: Client | None = None
+
+    def chat_bucket(self, chat_id: Any) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._prune_buckets()
+            bucket = self.chat_buckets[key] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        for key, bucket in list(self.chat_buckets.items()):
+            if bucket.is_idle():
+                del self.chat_buckets[key]
+
+    async def _call(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        chat_id: Any,
+        /,
+        *args: Any,
+        chat_token: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        """Call `func` once its buckets allow it. `chat_token` tells that a chat token was already taken for it."""
+        chat_bucket = self.chat_bucket(chat_id) if chat_id is not None and name in CHAT_METHODS else None
+        bucket = self.delete_bucket if name in DELETE_METHODS else self.global_bucket
+        # the span includes the time spent waiting for a token
+        with span(f"api:{name}"):
+            attempt = 0
+            while True:
+                if chat_bucket is not None and not chat_token:
+                    await chat_bucket.acquire()
+                chat_token = False
+                await bucket.acquire()
+
+                try:
+                    return await func(*args, **kwargs)
+                except FloodWait as e:
+                    wait = float(e.value or 0)  # type: ignore
+                    if attempt >= MAX_FLOOD_RETRIES or wait > MAX_FLOOD_WAIT:
+                        raise
+
+                    attempt += 1
+                    logger.warning(
+                        "%s got FloodWait, pausing for %ss (attempt %s/%s)", name, wait, attempt, MAX_FLOOD_RETRIES
+                    )
+                    (chat_bucket or bucket).pause(wait + 1)
+
+    async def _edit(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        chat_id: Any,
+        message_id: int,
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        key = (f"{name}:{chat_id}", message_id)
+        pending = self.pending_edits.get(key)
+        if pending is not None:
+            # still waiting for a token, send this text instead
+            self.collapsed_edits += 1
+            pending.args, pending.kwargs = args, kwargs
+            pending.waiters += 1
+        else:
+            pending = self.pending_edits[key] = _PendingEdit(args, kwargs)
+            # sent by a task of its own, so a cancelled caller does not take the edit of the others down with it
+            pending.task = asyncio.get_running_loop().create_task(self._send_edit(key, pending, name, func, chat_id))
+
+        try:
+            return await asyncio.shield(pending.future)
+        except asyncio.CancelledError:
+            pending.waiters -= 1
+            if pending.waiters == 0 and pending.task is not None:
+                pending.task.cancel()
+            raise
+
+    async def _send_edit(
+        self,
+        key: tuple[str, int],
+        pending: _PendingEdit,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        chat_id: Any,
+    ) -> None:
+        try:
+            try:
+                # newer edits can replace this one until it is the chat's turn
+                await self.chat_bucket(chat_id).acquire()
+            finally:
+                del self.pending_edits[key]
+
+            result = await self._call(name, func, chat_id, *pending.args, chat_token=True, **pending.kwargs)
+        except asyncio.CancelledError:
+            # only happens when every caller was cancelled
+            pending.future.cancel()
+        except Exception as e:  # noqa: BLE001
+            # raised in the callers
+            pending.future.set_exception(e)
+        else:
+            pending.future.set_result(result)
+
+    def wrap(self, name: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            chat_id = arguments.get("chat_id")
+            message_id = arguments.get("message_id")
+
+            if name in EDIT_METHODS and chat_id is not None and isinstance(message_id, int):
+                return await self._edit(name, func, chat_id, message_id, *args, **kwargs)
+            return await self._call(name, func, chat_id, *args, **kwargs)
+
+        return wrapper
+
+    def install(self, app: Client) -> None:
+        """Route the outgoing calls of `app` through the scheduler. Calls made through `Message` methods are covered
+        too, they end up calling the client."""
+        if self._installed_on is app:
+            return
+
+        for name in CHAT_METHODS + DELETE_METHODS:
+            setattr(app, name, self.wrap(name, getattr(app, name)))
+        self._installed_on = app
+
+
+scheduler: Scheduler = Scheduler()
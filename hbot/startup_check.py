@@ -0,0 +1,68 @@
+"""Startup budget check: `python -m hbot.startup_check [--budget SECONDS] [--lazy]`.
+
+Imports the bot and loads every plugin (without connecting to Telegram) in a fresh interpreter with startup
+profiling enabled, prints the profile and exits with status 1 if it took longer than the budget.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+DEFAULT_BUDGET: float = 5.0  # seconds
+
+
+def _child() -> int:
+    from pyrogram.client import Client
+
+    from hbot import LAZY_PLUGINS, STARTUP_BUDGET, startup_profile
+    from hbot.plugins_loader import load_plugins
+
+    startup_profile.mark("hbot.main imported")
+
+    async def load() -> None:
+        app = Client("hbot", api_id=1, api_hash="startup-check", in_memory=True)
+        load_plugins(app, lazy=LAZY_PLUGINS)
+
+    asyncio.run(load())
+    elapsed = startup_profile.mark("plugins loaded")
+    print(startup_profile.report())
+
+    if elapsed > STARTUP_BUDGET:
+        print(f"FAIL: startup took {elapsed:.3f}s, over the {STARTUP_BUDGET:.3f}s budget")
+        return 1
+    print(f"OK: startup took {elapsed:.3f}s, budget is {STARTUP_BUDGET:.3f}s")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m hbot.startup_check", description=__doc__)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="seconds, default %(default)s")
+    parser.add_argument("--lazy", action="store_true", help="load plugins lazily (HBOT_LAZY_PLUGINS=1)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import hbot.main  # noqa: F401
+        from hbot import coloured_logging_setup  # noqa: F401
+
+        return _child()
+
+    with tempfile.TemporaryDirectory() as persist_dir:
+        env = os.environ | {
+            "HBOT_PROFILE_STARTUP": "1",
+            "HBOT_STARTUP_BUDGET": str(args.budget),
+            "HBOT_LAZY_PLUGINS": "1" if args.lazy else "0",
+            "HBOT_LOG_FILE": "0",
+            # plugins may write to their storage while loading, keep the real one out of it
+            "PERSIST_DIR": persist_dir,
+            "API_ID": os.getenv("API_ID") or "1",
+            "API_HASH": os.getenv("API_HASH") or "startup-check",
+        }
+        return subprocess.run([sys.executable, "-m", "hbot.startup_check", "--child"], env=env).returncode  # noqa: S603
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import sys
+import threading
+import time
+from collections.abc import Callable, Sequence
+from importlib.machinery import ModuleSpec
+from types import ModuleType
+
+# Enabled with HBOT_PROFILE_STARTUP=1. `start()` is called by `hbot/__init__.py`, so everything imported after the
+# hbot package itself is timed, including uvloop, pyrogram and the plugins.
+
+_start_time: float | None = None
+_marks: list[tuple[str, float]] = []
+
+
+class ImportTimer:
+    """Meta path finder that times `exec_module` of every module imported after it is installed.
+
+    It doesn't find anything itself, it asks the other finders and wraps the loader of the spec they return.
+    Modules imported while another one is executing are counted in that module's total, but not in its own time.
+    """
+
+    def __init__(self) -> None:
+        # name -> (own time, total time)
+        self.modules: dict[str, tuple[float, float]] = {}
+        self._local: threading.local = threading.local()
+
+    def find_spec(
+        self, fullname: str, path: Sequence[str] | None, target: ModuleType | None = None
+    ) -> ModuleSpec | None:
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # builtin and frozen modules use the loader class itself, patching it would affect every module
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            loader.exec_module = self._timed(fullname, loader.exec_module)  # type: ignore
+        return spec
+
+    def _timed(self, name: str, exec_module: Callable[[ModuleType], None]) -> Callable[[ModuleType], None]:
+        def timed_exec_module(module: ModuleType) -> None:
+            stack: list[float] = self._local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter() - start
+                children = stack.pop()
+                self.modules[name] = (total - children, total)
+                if stack:
+                    stack[-1] += total
+
+        return timed_exec_module
+
+    def top(self, count: int) -> list[tuple[str, float, float]]:
+        return sorted(((n, own, total) for n, (own, total) in self.modules.items()), key=lambda x: -x[2])[:count]
+
+
+timer: ImportTimer = ImportTimer()
+
+
+def start() -> None:
+    global _start_time
+    if _start_time is not None:
+        return
+
+    _start_time = time.perf_counter()
+    sys.meta_path.insert(0, timer)  # type: ignore
+
+
+def enabled() -> bool:
+    return _start_time is not None
+
+
+def mark(name: str) -> float:
+    """Record that startup reached `name`, returns the seconds elapsed since `start()` (0 when profiling is off)."""
+    if _start_time is None:
+        return 0.0
+
+    elapsed = time.perf_counter() - _start_time
+    _marks.append((name, elapsed))
+    return elapsed
+
+
+def report(top: int = 25) -> str:
+    lines = ["startup profile:"]
+    lines.extend(f"  {elapsed:8.3f}s  {name}" for name, elapsed in _marks)
+    lines.append(f"slowest imports (own / total seconds, {len(timer.modules)} modules timed):")
+    lines.extend(f"  {own:8.3f} {total:8.3f}  {name}" for name, own, total in timer.top(top))
+    return "\n".join(lines)
@@ -0,0 +1,272 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Iterator, MutableMapping
+from pathlib import Path
+from typing import Any, Protocol
+
+from hbot import PERSIST_DIR, STORAGE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(Protocol):
+    def load(self, namespace: str) -> dict[str, Any]: ...
+
+    def encode(self, namespace: str, data: dict[str, Any], dirty: set[str], deleted: set[str]) -> Any:
+        """Serialize the pending changes. Runs on the event loop, so `data` cannot change underneath it."""
+        ...
+
+    def write(self, namespace: str, payload: Any) -> None:
+        """Persist what `encode` returned. Runs in a worker thread."""
+        ...
+
+    def close(self) -> None: ...
+
+
+class JsonBackend:
+    """One JSON file per namespace, same layout as `jsondb` so existing data is picked up as-is.
+
+    Every write replaces the whole file, atomically (temp file + rename).
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory: Path = directory
+
+    def _file(self, namespace: str) -> Path:
+        return self.directory.joinpath(f"{namespace}.json")
+
+    def load(self, namespace: str) -> dict[str, Any]:
+        file = self._file(namespace)
+        if not file.is_file():
+            return {}
+
+        with open(file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def encode(self, namespace: str, data: dict[str, Any], dirty: set[str], deleted: set[str]) -> str:
+        return json.dumps(data, indent=2)
+
+    def write(self, namespace: str, payload: str) -> None:
+        file = self._file(namespace)
+        tmp_file = file.with_name(f"{file.name}.tmp")
+
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_file, file)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBackend:
+    """All namespaces in a single SQLite database in WAL mode, one row per key.
+
+    Only the keys that changed are written, so large caches are not rewritten on every change.
+    The first time a namespace is loaded, it is imported from its JSON file if there is one. That happens only
+    once, a namespace that was emptied later is not imported again.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory: Path = directory
+        self._lock: threading.Lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # opened on first use, so that importing this module does not touch PERSIST_DIR
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.directory.joinpath("hbot.sqlite3"), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (namespace, key)"
+                ") WITHOUT ROWID"
+            )
+            # namespaces that were (or did not need to be) imported from JSON
+            self._conn.execute("CREATE TABLE IF NOT EXISTS migrated (namespace TEXT PRIMARY KEY) WITHOUT ROWID")
+            self._conn.commit()
+
+        return self._conn
+
+    def load(self, namespace: str) -> dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT key, value FROM kv WHERE namespace = ?", (namespace,)).fetchall()
+            migrated = conn.execute("SELECT 1 FROM migrated WHERE namespace = ?", (namespace,)).fetchone()
+
+        if migrated is not None:
+            return {key: json.loads(value) for key, value in rows}
+
+        # namespaces that already have rows were written before the marker existed, they are not imported either
+        legacy: dict[str, Any] = {} if rows else JsonBackend(self.directory).load(namespace)
+        if legacy:
+            logger.info("importing namespace '%s' from its JSON file", namespace)
+
+        upserts, _ = self.encode(namespace, legacy, set(legacy), set())
+        with self._lock, self._connection() as conn:
+            conn.executemany("INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?)", upserts)
+            conn.execute("INSERT OR IGNORE INTO migrated (namespace) VALUES (?)", (namespace,))
+
+        return legacy or {key: json.loads(value) for key, value in rows}
+
+    def encode(
+        self, namespace: str, data: dict[str, Any], dirty: set[str], deleted: set[str]
+    ) -> tuple[list[tuple[str, str, str]], list[tuple[str, str]]]:
+        upserts = [(namespace, key, json.dumps(data[key])) for key in dirty if key in data]
+        deletes = [(namespace, key) for key in deleted]
+        return upserts, deletes
+
+    def write(self, namespace: str, payload: tuple[list[tuple[str, str, str]], list[tuple[str, str]]]) -> None:
+        upserts, deletes = payload
+        with self._lock, self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                upserts,
+            )
+            conn.executemany("DELETE FROM kv WHERE namespace = ? AND key = ?", deletes)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class Namespace(MutableMapping[str, Any]):
+    """In-memory data of one namespace. Changes are written back in the background by `Storage`.
+
+    Assigning or deleting a key is tracked automatically. If a value is mutated in place (e.g. appending to a
+    list), call `mark_dirty` with its key.
+    """
+
+    def __init__(self, storage: "Storage", name: str, data: dict[str, Any]) -> None:
+        self.storage: Storage = storage
+        self.name: str = name
+        self.data: dict[str, Any] = data
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.data[key] = value
+        self.mark_dirty(key)
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        self.storage.schedule_flush(self)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def mark_dirty(self, key: str) -> None:
+        self._deleted.discard(key)
+        self._dirty.add(key)
+        self.storage.schedule_flush(self)
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._dirty or self._deleted)
+
+    def _take_changes(self) -> tuple[set[str], set[str]]:
+        dirty, deleted = self._dirty, self._deleted
+        self._dirty, self._deleted = set(), set()
+        return dirty, deleted
+
+
+class Storage:
+    """Keeps every namespace in memory and coalesces writes into debounced background flushes."""
+
+    def __init__(self, backend: Backend, flush_delay: float = 1.0) -> None:
+        self.backend: Backend = backend
+        self.flush_delay: float = flush_delay
+        self._namespaces: dict[str, Namespace] = {}
+        self._pending: dict[str, Namespace] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_lock: threading.Lock = threading.Lock()
+
+    def namespace(self, name: str) -> Namespace:
+        ns = self._namespaces.get(name)
+        if ns is None:
+            ns = Namespace(self, name, self.backend.load(name))
+            self._namespaces[name] = ns
+
+        return ns
+
+    def schedule_flush(self, ns: Namespace) -> None:
+        self._pending[ns.name] = ns
+        if self._timer is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no loop (e.g. at import time), the change is written by the next flush or at exit
+            return
+
+        self._timer = loop.call_later(self.flush_delay, lambda: loop.create_task(self.flush()))
+
+    def _encode_pending(self) -> list[tuple[str, Any]]:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        jobs: list[tuple[str, Any]] = []
+        for ns in self._pending.values():
+            if not ns.is_dirty:
+                continue
+
+            dirty, deleted = ns._take_changes()
+            jobs.append((ns.name, self.backend.encode(ns.name, ns.data, dirty, deleted)))
+
+        self._pending.clear()
+        return jobs
+
+    def _write(self, jobs: list[tuple[str, Any]]) -> None:
+        with self._flush_lock:
+            for name, payload in jobs:
+                logger.debug("flushing namespace '%s'", name)
+                self.backend.write(name, payload)
+
+    async def flush(self) -> None:
+        jobs = self._encode_pending()
+        if jobs:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, jobs)
+
+    def flush_sync(self) -> None:
+        """Write pending changes right away, in the calling thread. Use before replacing the process."""
+        self._write(self._encode_pending())
+
+    async def aclose(self) -> None:
+        await self.flush()
+        self.backend.close()
+        atexit.unregister(self.flush_sync)
+
+
+def _create_backend(kind: str) -> Backend:
+    if kind == "sqlite":
+        return SqliteBackend(PERSIST_DIR)
+
+    if kind != "json":
+        logger.warning("unknown storage backend '%s', falling back to json", kind)
+
+    return JsonBackend(PERSIST_DIR)
+
+
+storage: Storage = Storage(_create_backend(STORAGE_BACKEND))
+atexit.register(storage.flush_sync)
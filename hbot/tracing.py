@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Every command the router dispatches runs in a trace. Its id is added to every log record emitted while handling
+# it (including from tasks it starts), and spans inside it are logged with their duration, for example:
+#
+#     with span("download"):
+#         await app.download_media(...)
+#
+# so the JSON log can be grouped by "trace" to see where a command spent its time.
+
+trace_id: ContextVar[str | None] = ContextVar("trace_id", default=None)
+_current_span: ContextVar[str | None] = ContextVar("current_span", default=None)
+
+# attributes of a log record that the JSON formatter writes out when they are set
+TRACE_FIELDS: tuple[str, ...] = ("trace", "span", "parent_span", "duration_ms", "status", "attrs")
+
+
+def new_trace_id() -> str:
+    return os.urandom(6).hex()
+
+
+@contextmanager
+def span(name: str, **fields: Any) -> Iterator[None]:
+    """Time the body and log it as a span of the current trace. Does nothing outside of a trace.
+
+    `fields` are logged with the span under "attrs", e.g. `span("download", member=name)`.
+    """
+    if trace_id.get() is None:
+        yield
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        _current_span.reset(token)
+        logger.info(
+            "span %s took %.1fms",
+            name,
+            duration_ms,
+            extra={
+                "span": name,
+                "parent_span": parent,
+                "duration_ms": duration_ms,
+                "status": status,
+                "attrs": fields or None,
+            },
+        )
+
+
+@contextmanager
+def trace(name: str, **fields: Any) -> Iterator[str]:
+    """Start a new trace and time the body as its root span. Yields the trace id.
+
+    Inside of a trace already (e.g. a lazily loaded plugin dispatching the command again), this is just a span.
+    """
+    current = trace_id.get()
+    if current is not None:
+        with span(name, **fields):
+            yield current
+        return
+
+    token = trace_id.set(new_trace_id())
+    try:
+        with span(name, **fields):
+            yield trace_id.get()  # type: ignore
+    finally:
+        trace_id.reset(token)
+
+
+def install_record_factory() -> None:
+    """Stamp every log record with the current trace id when it is created.
+
+    This has to happen where the record is created, not in a handler or filter: with queued logging those run in
+    another thread, where the context of the caller is not available.
+    """
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "_hbot_tracing", False):
+        return
+
+    def record_factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        record.trace = trace_id.get()
+        return record
+
+    record_factory._hbot_tracing = True  # type: ignore
+    logging.setLogRecordFactory(record_factory)